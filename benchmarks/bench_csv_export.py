@@ -0,0 +1,77 @@
+"""Выгрузка ParseResult: прежний экспорт через pandas против потокового csv/csv.gz/xlsx.
+
+Запуск: python -m benchmarks.bench_csv_export
+"""
+import io
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.bench_wire_format import make_result
+from source.core.dto import ParseResult
+from source.utils.csv_exporter import COLUMNS, _force_text, result_to_bytes, result_to_csv_bytes
+
+ROUNDS = 3
+
+
+def legacy_result_to_csv_bytes(result: ParseResult, header: bool = True) -> bytes:
+    # Экспорт до перехода на потоковую запись, для сравнения
+    rows = []
+    for p in result.products:
+        in_stock = getattr(p, "in_stock", True)
+        rows.append({
+            "product_id": p.product_id,
+            "name": (getattr(p, "name", "") or "").strip(),
+            "price": _force_text(getattr(p, "price", "")),
+            "old_price": _force_text(getattr(p, "old_price", "")) if getattr(p, "old_price", None) else "",
+            "calories": _force_text(getattr(p, "calories", "")) if getattr(p, "calories", None) else "",
+            "proteins": _force_text(getattr(p, "proteins", "")) if getattr(p, "proteins", None) else "",
+            "fats": _force_text(getattr(p, "fats", "")) if getattr(p, "fats", None) else "",
+            "carbs": _force_text(getattr(p, "carbs", "")) if getattr(p, "carbs", None) else "",
+            "weight": getattr(p, "weight", "") or "",
+            "ingredients": str(getattr(p, "ingredients", "") or "").replace("\n", " ").replace("\r", ""),
+            "photos": " | ".join(getattr(p, "photos", [])[:5]) if getattr(p, "photos", None) else "",
+            "category": getattr(p, "category", "") or "",
+            "store": getattr(p, "store", "") or "",
+            "Наличие": "Есть" if in_stock else "Нет",
+        })
+    df = pd.DataFrame(rows).reindex(columns=COLUMNS)
+    output = io.StringIO()
+    df.to_csv(output, sep=";", index=False, header=header, encoding="utf-8-sig", lineterminator="\n")
+    return output.getvalue().encode("utf-8-sig" if header else "utf-8")
+
+
+def measure(fn, rounds: int = ROUNDS):
+    best, value = float("inf"), None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, value
+
+
+def main():
+    for count in (1_000, 10_000, 100_000):
+        result = make_result(count)
+        variants = {
+            "pandas": lambda: legacy_result_to_csv_bytes(result),
+            "csv": lambda: result_to_csv_bytes(result),
+            "csv.gz": lambda: result_to_bytes(result, "csv.gz"),
+            "xlsx": lambda: result_to_bytes(result, "xlsx"),
+        }
+        outputs = {}
+        print(f"{count:>6} товаров")
+        for name, fn in variants.items():
+            seconds, peak, data = measure(fn, 1 if name == "xlsx" and count >= 100_000 else ROUNDS)
+            outputs[name] = data
+            print(f"  {name:>7}: {seconds * 1000:8.1f} мс, пик памяти {peak / 2**20:7.1f} МБ, размер {len(data) / 2**20:6.1f} МБ")
+        assert outputs["csv"] == outputs["pandas"], "потоковый CSV расходится с прежним экспортом"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Сравнение обогащения fast-режима: скан DataFrame против словарного индекса.
+
+Запуск: python -m benchmarks.bench_heavy_index
+"""
+import random
+import time
+
+import pandas as pd
+
+from source.infra.heavy_cache import build_heavy_index
+
+LOOKUPS = 2_000
+
+
+def make_heavy_df(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "product_id": [str(100000 + i) for i in range(rows)],
+        "name": [f"Товар {i}" for i in range(rows)],
+        "calories": [str(random.randint(50, 500)) for _ in range(rows)],
+        "proteins": [f"{random.uniform(0, 30):.1f}" for _ in range(rows)],
+        "fats": [f"{random.uniform(0, 30):.1f}" for _ in range(rows)],
+        "carbs": [f"{random.uniform(0, 60):.1f}" for _ in range(rows)],
+        "ingredients": ["вода, соль, мука пшеничная, масло подсолнечное" for _ in range(rows)],
+        "photos": ["https://img.example/1.jpg | https://img.example/2.jpg" for _ in range(rows)],
+    })
+
+
+def bench_scan(df: pd.DataFrame, pids: list) -> float:
+    start = time.perf_counter()
+    for pid in pids:
+        match = df[df["product_id"] == pid]
+        if not match.empty:
+            match.iloc[0].get("calories")
+    return time.perf_counter() - start
+
+
+def bench_index(df: pd.DataFrame, pids: list) -> tuple[float, float]:
+    start = time.perf_counter()
+    index = build_heavy_index(df.copy(), "product_id")
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for pid in pids:
+        row = index.get(pid)
+        if row is not None:
+            row.get("calories")
+    return built, time.perf_counter() - start
+
+
+def main():
+    random.seed(42)
+    for rows in (5_000, 50_000):
+        df = make_heavy_df(rows)
+        pids = [str(100000 + random.randrange(rows * 2)) for _ in range(LOOKUPS)]
+
+        scan = bench_scan(df, pids)
+        built, lookup = bench_index(df, pids)
+        print(
+            f"{rows:>6} строк | {LOOKUPS} товаров | "
+            f"скан: {scan * 1000:9.1f} мс | "
+            f"индекс: сборка {built * 1000:7.1f} мс + поиск {lookup * 1000:6.2f} мс | "
+            f"x{scan / (built + lookup):.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
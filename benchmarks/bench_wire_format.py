@@ -0,0 +1,76 @@
+"""Размер и скорость кодирования ParseResult: JSON против wire-формата v1.
+
+Запуск: python -m benchmarks.bench_wire_format
+"""
+import random
+import time
+
+from source.core.dto import ParseResult, ProductDetail
+from source.utils.wire import CT_JSON, decode_result, encode_result
+
+ROUNDS = 5
+
+
+def make_result(products: int) -> ParseResult:
+    return ParseResult(
+        task_id="bench",
+        service="vkusvill",
+        mode="heavy",
+        products=[
+            ProductDetail(
+                product_id=str(100000 + i),
+                name=f"Салат с курицей и овощами №{i}",
+                price=round(random.uniform(90, 900), 2),
+                old_price=round(random.uniform(100, 1000), 2) if i % 3 == 0 else None,
+                calories=random.randint(50, 500),
+                proteins=round(random.uniform(0, 30), 1),
+                fats=round(random.uniform(0, 30), 1),
+                carbs=round(random.uniform(0, 60), 1),
+                weight="250 г",
+                ingredients="курица отварная, огурцы свежие, томаты, салат айсберг, соус на основе "
+                            "майонеза (масло подсолнечное, яичный желток, горчица, соль, сахар)",
+                photos=[f"https://img.vkusvill.ru/pim/images/site/{i}_{n}.jpg" for n in range(10)],
+                category="Готовая еда",
+                store="ВкусВилл",
+            )
+            for i in range(products)
+        ],
+        took_seconds=42.0,
+        user_id=1,
+        chat_id=1,
+    )
+
+
+def timed(fn, rounds: int = ROUNDS):
+    best, value = float("inf"), None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def main():
+    random.seed(42)
+    for count in (1_000, 5_000):
+        result = make_result(count)
+
+        json_enc, json_data = timed(result.model_dump_json)
+        json_dec, _ = timed(lambda: decode_result({b"data": json_data.encode(), b"ct": CT_JSON.encode()}))
+
+        v1_enc, v1_fields = timed(lambda: encode_result(result))
+        v1_dec, decoded = timed(lambda: decode_result({k.encode(): v for k, v in v1_fields.items()}))
+        assert len(decoded.products) == count
+
+        json_size = len(json_data.encode())
+        v1_size = len(v1_fields["data"])
+        print(
+            f"{count:>5} товаров | "
+            f"JSON: {json_size / 1024:8.0f} КБ, enc {json_enc * 1000:6.1f} мс, dec {json_dec * 1000:6.1f} мс | "
+            f"v1: {v1_size / 1024:6.0f} КБ, enc {v1_enc * 1000:6.1f} мс, dec {v1_dec * 1000:6.1f} мс | "
+            f"размер x{json_size / v1_size:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
 from abc import ABC, abstractmethod
-from source.core.dto import Task, ParseResult
+from typing import List, Optional
+from source.core.dto import Task, ParseResult, ProductDetail
+
+class ResultSink(ABC):
+    """Получатель частичных результатов: товары уходят пачками, пока парсинг идёт."""
+
+    @abstractmethod
+    async def add(self, products: List[ProductDetail]) -> None:
+        pass
 
 class BaseParser(ABC):
     @abstractmethod
@@ -10,7 +18,23 @@ class BaseParser(ABC):
     async def parse_heavy(self, task: Task) -> ParseResult:
         pass
 
+    async def parse_incremental(self, task: Task) -> ParseResult:
+        return await self.parse_heavy(task)
+
+    async def close(self) -> None:
+        pass
+
     async def parse(self, task: Task) -> ParseResult:
         if task.mode == "fast":
             return await self.parse_fast(task)
-        return await self.parse_heavy(task)
\ No newline at end of file
+        if task.mode == "incremental":
+            return await self.parse_incremental(task)
+        return await self.parse_heavy(task)
+
+    @staticmethod
+    async def emit(sink: Optional[ResultSink], products: List[ProductDetail], collected: list) -> None:
+        # Без sink товары копятся в итоговом списке, со sink — сразу уходят наружу
+        if sink is None:
+            collected.extend(products)
+        elif products:
+            await sink.add(products)
@@ -23,6 +23,33 @@ class Settings(BaseSettings):
             return []
         return [p.strip() for p in self.VKUSVILL_PROXIES.split(",") if p.strip()]
 
+    KUPER_PROXIES: str = ""
+
+    @property
+    def KUPER_PROXY_LIST(self) -> List[str]:
+        if not self.KUPER_PROXIES:
+            return []
+        return [p.strip() for p in self.KUPER_PROXIES.split(",") if p.strip()]
+
+    PROXY_LEASE_TTL: float = 300.0
+    PROXY_QUARANTINE_AFTER: int = 3
+    PROXY_QUARANTINE_SECONDS: float = 120.0
+
+    RATE_LIMIT_INITIAL: float = 10.0
+    RATE_LIMIT_MIN: float = 0.5
+    RATE_LIMIT_MAX: float = 50.0
+    RATE_LIMIT_BURST: float = 10.0
+    RATE_LIMIT_INCREASE: float = 1.0
+    RATE_LIMIT_DECREASE: float = 0.5
+
+    CARD_RETRIES: int = 2
+    CARD_BACKOFF_BASE: float = 0.5
+    CARD_BACKOFF_MAX: float = 8.0
+    CARD_DEADLINE: float = 20.0
+    CARD_HEDGE: bool = False
+    CARD_HEDGE_QUANTILE: float = 0.95
+    PAGE_RETRIES: int = 3
+
     VKUSVILL_CITY_COORDS: Dict[str, tuple[float, float]] = {
         "москва": (55.7558, 37.6173),
         "санкт-петербург": (59.9343, 30.3351),
@@ -33,8 +60,63 @@ class Settings(BaseSettings):
         "казань": (55.8304, 49.0661),
     }
 
+    GEO_CACHE_TTL: int = 30 * 24 * 3600
+    GEO_NEGATIVE_TTL: int = 3600
+    GEO_MEMORY_CACHE_SIZE: int = 1024
+    GEO_MEMORY_CACHE_TTL: int = 6 * 3600
+
     DATA_DIR: str = "source/data"
     INPUT_STREAM: str = "food_parse_tasks"
     OUTPUT_STREAM: str = "food_parse_results"
+    CONSUMER_GROUP: str = "food_group"
+    CONSUMER_NAME: str = ""
+    WORKER_CONCURRENCY: int = 4
+    WORKER_SHUTDOWN_TIMEOUT: float = 60.0
+    BACKGROUND_SHUTDOWN_TIMEOUT: float = 5.0
+    DEAD_LETTER_STREAM: str = "food_parse_tasks_dead"
+    MAX_DELIVERIES: int = 3
+    RECLAIM_IDLE_MS: int = 5 * 60 * 1000
+    RECLAIM_INTERVAL: float = 30.0
+    HEARTBEAT_INTERVAL: float = 30.0
+    RESULT_CHUNK_SIZE: int = 200
+    WIRE_FORMAT: str = "v1"
+    WIRE_COMPRESSION_LEVEL: int = 3
+    CLAIM_CHECK_THRESHOLD: int = 256 * 1024
+    CLAIM_CHECK_BACKEND: str = "redis"
+    CLAIM_CHECK_TTL: int = 24 * 3600
+    CLAIM_CHECK_DIR: str = "source/data/results"
+    EXPORT_FORMAT: str = "csv"
+    OFFLOAD_KIND: str = "thread"
+    OFFLOAD_WORKERS: int = 4
+    LOOP_MONITOR_THRESHOLD: float = 0.5
+    STARTUP_REPORT_TOP: int = 15
+    BOT_CONSUMER_GROUP: str = "bot_group"
+    BOT_CONSUMER_NAME: str = "admin-bot"
+    BOT_MAX_IN_FLIGHT: int = 64
+    BOT_SEND_CONCURRENCY: int = 8
+    BOT_CHAT_CONCURRENCY: int = 1
+    BOT_DEDUP_WINDOW: int = 10000
+    BOT_RECLAIM_IDLE_MS: int = 60 * 1000
+    BOT_RECLAIM_INTERVAL: float = 30.0
+
+    VKUSVILL_HEAVY_CONCURRENCY: int = 8
+    VKUSVILL_SESSION_POOL_SIZE: int = 32
+    VKUSVILL_SESSION_IDLE_TTL: float = 600.0
+    VKUSVILL_SHOPNO_GRID: float = 0.005
+    VKUSVILL_SHOPNO_TTL: int = 24 * 3600
+    VKUSVILL_PAGE_LIMIT: int = 60
+    VKUSVILL_PAGE_WINDOW: int = 4
+    KUPER_HOST_CONCURRENCY: int = 16
+    KUPER_STORE_GRID: float = 0.01
+    KUPER_STORE_TTL: int = 6 * 3600
+    KUPER_TAXONS_TTL: int = 12 * 3600
+    KUPER_CACHE_LOCK_TIMEOUT: float = 10.0
+    KUPER_PAGE_LIMIT: int = 24
+    KUPER_PAGE_WINDOW: int = 6
+
+    HEAVY_CACHE_MAX_FILES: int = 16
+    HEAVY_CACHE_MAX_ROWS: int = 500_000
+    CATALOG_CACHE_TTL: int = 7 * 24 * 3600
+    CATALOG_MAX_AGE: int = 24 * 3600
 
 settings = Settings()
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 
 class Geo(BaseModel):
     lat: float
@@ -8,12 +8,13 @@ class Geo(BaseModel):
 class Task(BaseModel):
     task_id: str
     service: Literal["vkusvill", "kuper"]
-    mode: Literal["fast", "heavy"]
+    mode: Literal["fast", "heavy", "incremental"]
     store: Optional[str] = None
     limit: Optional[int] = 500
     city: str = "москва"      
     user_id: int              
     chat_id: int             
+    stream: bool = False
 
 class ProductID(BaseModel):
     product_id: str
@@ -42,4 +43,5 @@ class ParseResult(BaseModel):
     products: List[ProductID | ProductDetail]
     took_seconds: float
     user_id: int
-    chat_id: int      
\ No newline at end of file
+    chat_id: int
+    stats: Dict[str, int] = {}      
\ No newline at end of file
@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+import redis.asyncio as redis
+
+from source.core.config import settings
+from source.core.dto import ProductDetail
+
+logger = logging.getLogger("catalog_cache")
+
+CatalogRecord = Dict[str, Optional[str]]
+
+
+def listing_fingerprint(*parts) -> str:
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+def is_stale(record: CatalogRecord, max_age: int) -> bool:
+    try:
+        return time.time() - int(record.get("fetched_at") or 0) > max_age
+    except ValueError:
+        return True
+
+
+def product_to_record(p: ProductDetail, fingerprint: Optional[str] = None) -> CatalogRecord:
+    return {
+        "fingerprint": fingerprint,
+        "name": p.name,
+        "calories": p.calories,
+        "proteins": p.proteins,
+        "fats": p.fats,
+        "carbs": p.carbs,
+        "ingredients": p.ingredients,
+        "photos": " | ".join(p.photos[:5]),
+    }
+
+
+class CatalogCache:
+    def __init__(self, prefix: str, ttl: int):
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, service: str, item_id: str) -> str:
+        return f"{self.prefix}:{service}:{item_id}"
+
+    async def put_many(self, r: redis.Redis, service: str, records: Dict[str, CatalogRecord], ttl: Optional[int] = None):
+        if not records:
+            return
+        ttl = ttl or self.ttl
+        fetched_at = str(int(time.time()))
+        async with r.pipeline(transaction=False) as pipe:
+            for item_id, record in records.items():
+                key = self._key(service, item_id)
+                mapping = {k: str(v) for k, v in record.items() if v not in (None, "")}
+                mapping["fetched_at"] = fetched_at
+                pipe.delete(key)
+                pipe.hset(key, mapping=mapping)
+                if ttl:
+                    pipe.expire(key, ttl)
+            await pipe.execute()
+        logger.info("Каталог %s | в Redis записано %d позиций", service, len(records))
+
+    async def get_many(self, r: redis.Redis, service: str, item_ids: Iterable[str]) -> Dict[str, CatalogRecord]:
+        item_ids = [i for i in dict.fromkeys(item_ids) if i]
+        if not item_ids:
+            return {}
+        async with r.pipeline(transaction=False) as pipe:
+            for item_id in item_ids:
+                pipe.hgetall(self._key(service, item_id))
+            rows = await pipe.execute()
+
+        found = {}
+        for item_id, row in zip(item_ids, rows):
+            if row:
+                found[item_id] = {
+                    (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                    for k, v in row.items()
+                }
+        return found
+
+
+catalog_cache = CatalogCache("catalog", settings.CATALOG_CACHE_TTL)
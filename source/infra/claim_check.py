@@ -0,0 +1,117 @@
+"""Claim-check для больших результатов.
+
+Если закодированный результат больше CLAIM_CHECK_THRESHOLD, он один раз
+пишется в Redis-ключ с TTL или в файл под CLAIM_CHECK_DIR, а в запись
+потока попадают только ссылка (ref) и короткая сводка (summary).
+Читатель забирает тело по ссылке, когда оно действительно нужно.
+"""
+import json
+import logging
+import os
+import uuid
+from typing import Optional
+
+import redis.asyncio as redis
+
+from source.core.config import settings
+from source.core.dto import ParseResult
+from source.utils.offload import run_blocking
+from source.utils.wire import decode_result, encode_result
+
+logger = logging.getLogger("claim_check")
+
+_REDIS_PREFIX = "redis:"
+_FILE_PREFIX = "file:"
+
+
+def _get(fields: dict, name: str):
+    value = fields.get(name.encode(), fields.get(name))
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _write_blob(path: str, payload: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(payload)
+
+
+def _read_blob(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def summarize(result: ParseResult, size: int) -> dict:
+    return {
+        "task_id": result.task_id,
+        "chat_id": result.chat_id,
+        "products": len(result.products),
+        "took_seconds": result.took_seconds,
+        "bytes": size,
+        "stats": result.stats,
+    }
+
+
+async def pack(r: redis.Redis, result: ParseResult) -> dict:
+    # Сериализация и zlib для тысяч товаров — заметная CPU-работа, не для цикла
+    fields = await run_blocking(encode_result, result)
+    data = fields["data"]
+    size = len(data)
+    if size < settings.CLAIM_CHECK_THRESHOLD:
+        return fields
+
+    name = f"{result.task_id}-{uuid.uuid4().hex[:8]}"
+    payload = data.encode() if isinstance(data, str) else data
+    if settings.CLAIM_CHECK_BACKEND == "file":
+        path = os.path.join(settings.CLAIM_CHECK_DIR, f"{name}.bin")
+        await run_blocking(_write_blob, path, payload)
+        ref = _FILE_PREFIX + path
+    else:
+        key = f"result:blob:{name}"
+        await r.set(key, payload, ex=settings.CLAIM_CHECK_TTL)
+        ref = _REDIS_PREFIX + key
+
+    logger.info("Результат %s вынесен по ссылке %s (%d КБ)", result.task_id, ref, size // 1024)
+    return {
+        "ct": fields["ct"],
+        "ref": ref,
+        "summary": json.dumps(summarize(result, size)),
+    }
+
+
+def summary(fields: dict) -> Optional[dict]:
+    raw = _get(fields, "summary")
+    return json.loads(raw) if raw else None
+
+
+async def unpack(r: redis.Redis, fields: dict) -> ParseResult:
+    ref = _get(fields, "ref")
+    if not ref:
+        return await run_blocking(decode_result, fields)
+
+    if ref.startswith(_FILE_PREFIX):
+        data = await run_blocking(_read_blob, ref[len(_FILE_PREFIX):])
+    elif ref.startswith(_REDIS_PREFIX):
+        data = await r.get(ref[len(_REDIS_PREFIX):])
+    else:
+        raise ValueError(f"Неизвестная ссылка на результат: {ref}")
+    if data is None:
+        raise LookupError(f"Результат по ссылке {ref} истёк или удалён")
+    return await run_blocking(decode_result, {"data": data, "ct": _get(fields, "ct")})
+
+
+async def discard(r: redis.Redis, fields: dict) -> None:
+    ref = _get(fields, "ref")
+    if not ref:
+        return
+    try:
+        if ref.startswith(_FILE_PREFIX):
+            await run_blocking(os.remove, ref[len(_FILE_PREFIX):])
+        elif ref.startswith(_REDIS_PREFIX):
+            await r.delete(ref[len(_REDIS_PREFIX):])
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Не удалось удалить результат %s: %s", ref, e)
@@ -1,9 +1,22 @@
 from async_tls_client.session.session import AsyncSession
 import logging
+from typing import Optional
+
+import redis.asyncio as redis
+
+from source.core.config import settings
+from source.infra.shared_cache import SharedCache
+from source.utils.lru import LRUCache
 
 logger = logging.getLogger(__name__)
 
-async def get_coords_by_city(city_name: str) -> tuple[float, float]:
+_NOT_FOUND = {"miss": True}
+
+_memory_cache = LRUCache(settings.GEO_MEMORY_CACHE_SIZE, ttl=settings.GEO_MEMORY_CACHE_TTL)
+_shared_cache = SharedCache("geo:city", settings.GEO_CACHE_TTL)
+
+
+async def _fetch_coords(city_name: str) -> dict:
     session = AsyncSession(client_identifier="chrome_120", random_tls_extension_order=True)
     headers = {
         'client-id': 'KuperAndroid',
@@ -31,15 +44,46 @@ async def get_coords_by_city(city_name: str) -> tuple[float, float]:
             },
             headers=headers
         )
+        # Ошибка сервиса (квота, ключ, 5xx) не должна попасть в кэш как «город не найден»
+        if resp.status != 200:
+            raise RuntimeError(f"2GIS ответил {resp.status}")
         data = resp.json()
-        point = data.get("result", {}).get("items", [{}])[0].get("point", {})
-        lat = float(point.get("lat", 55.7558))
-        lon = float(point.get("lon", 37.6173))
-        logger.error(f"2GIS: {city_name} → {lat}, {lon}")
-
-        return lat, lon
-    except Exception as e:
-        logger.error(f"2GIS ошибка для {city_name}: {e}")
-        return 55.7558, 37.6173
+        code = (data.get("meta") or {}).get("code", 200)
+        if code == 404:
+            logger.warning(f"2GIS: {city_name} не найден")
+            return _NOT_FOUND
+        if code != 200 or not isinstance(data.get("result"), dict):
+            raise RuntimeError(f"2GIS вернул ошибку: {data.get('meta')}")
+        items = data["result"].get("items") or []
+        point = items[0].get("point") if items else None
+        if not point or "lat" not in point or "lon" not in point:
+            logger.warning(f"2GIS: {city_name} не найден")
+            return _NOT_FOUND
+
+        lat = float(point["lat"])
+        lon = float(point["lon"])
+        logger.info(f"2GIS: {city_name} → {lat}, {lon}")
+        return {"lat": lat, "lon": lon}
     finally:
-        await session.close()
\ No newline at end of file
+        await session.close()
+
+
+def _cache_ttl(value: dict) -> int:
+    return settings.GEO_NEGATIVE_TTL if value.get("miss") else settings.GEO_CACHE_TTL
+
+
+async def get_coords_by_city(city_name: str, r: Optional[redis.Redis] = None) -> Optional[tuple[float, float]]:
+    key = " ".join(city_name.strip().lower().split())
+    value = _memory_cache.get(key)
+
+    if value is None:
+        try:
+            value = await _shared_cache.get_or_load(r, (key,), lambda: _fetch_coords(key), ttl=_cache_ttl)
+        except Exception as e:
+            logger.error(f"2GIS ошибка для {city_name}: {e}")
+            return None
+        _memory_cache.set(key, value, ttl=min(_cache_ttl(value), settings.GEO_MEMORY_CACHE_TTL))
+
+    if value.get("miss"):
+        return None
+    return value["lat"], value["lon"]
@@ -0,0 +1,123 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from source.core.config import settings
+from source.utils.concurrency import KeyedSemaphore
+from source.utils.offload import run_blocking
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger("heavy_cache")
+
+HeavyIndex = Dict[str, Dict[str, Optional[str]]]
+
+
+def build_heavy_index(df: "pd.DataFrame", key: str) -> HeavyIndex:
+    df[key] = df[key].str.strip()
+    df = df.drop_duplicates(subset=[key], keep="first")
+    index: HeavyIndex = {}
+    for row in df.to_dict("records"):
+        index[row[key]] = {k: (v or None) for k, v in row.items()}
+    return index
+
+
+def load_heavy_index(path: str, key: str) -> HeavyIndex:
+    # pandas грузится только там, где реально читается или пишется кэш
+    import pandas as pd
+
+    df = pd.read_csv(path, sep=";", dtype=str, keep_default_na=False)
+    return build_heavy_index(df, key)
+
+
+def save_heavy_csv(path: str, rows: List[dict], key: Optional[str] = None) -> int:
+    import pandas as pd
+
+    df = pd.DataFrame(rows)
+    if key:
+        df.drop_duplicates(subset=[key], keep="last", inplace=True)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Через временный файл: fast-режим не прочитает недописанный CSV
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, sep=";", index=False, encoding="utf-8-sig")
+    os.replace(tmp_path, path)
+    return len(df)
+
+
+class _HeavyEntry:
+    __slots__ = ("signature", "index")
+
+    def __init__(self, signature: Tuple[int, int], index: HeavyIndex):
+        self.signature = signature
+        self.index = index
+
+
+class HeavyCacheManager:
+    def __init__(self, max_files: int, max_rows: int):
+        self.max_files = max(1, max_files)
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[Tuple[str, str], _HeavyEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self._loading = KeyedSemaphore(1)
+
+    @property
+    def rows(self) -> int:
+        return sum(len(e.index) for e in self._entries.values())
+
+    async def get(self, path: str, key: str) -> Optional[HeavyIndex]:
+        cache_key = (path, key)
+        # Один разбор файла на все задачи, которым он понадобился одновременно
+        async with self._loading.hold(cache_key):
+            return await self._get(path, key, cache_key)
+
+    async def _get(self, path: str, key: str, cache_key: Tuple[str, str]) -> Optional[HeavyIndex]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._entries.pop(cache_key, None)
+            return None
+
+        signature = (st.st_mtime_ns, st.st_size)
+        entry = self._entries.get(cache_key)
+        if entry is not None and entry.signature == signature:
+            self.hits += 1
+            self._entries.move_to_end(cache_key)
+            return entry.index
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.reloads += 1
+            logger.info("Heavy кэш изменился на диске, перечитываем: %s", path)
+
+        index = await run_blocking(load_heavy_index, path, key)
+        self._entries[cache_key] = _HeavyEntry(signature, index)
+        self._entries.move_to_end(cache_key)
+        self._evict()
+        return index
+
+    def _evict(self) -> None:
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_files or (self.max_rows and self.rows > self.max_rows)
+        ):
+            (path, _), _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.info("Heavy кэш вытеснен из памяти: %s", path)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._entries),
+            "rows": self.rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+        }
+
+
+heavy_cache = HeavyCacheManager(settings.HEAVY_CACHE_MAX_FILES, settings.HEAVY_CACHE_MAX_ROWS)
@@ -0,0 +1,199 @@
+"""Incremental-режим, общий для парсеров.
+
+Листинг сверяется с каталогом в Redis по отпечатку: карточки запрашиваются
+только для новых и изменённых товаров, остальные собираются из листинга и
+записи каталога. Устаревшие записи обновляются в фоне уже после ответа.
+
+Парсер задаёт SERVICE, card_concurrency и хуки: _open_incremental /
+_close_incremental (сессия, прокси, магазин — всё это scope),
+_incremental_pages, _incremental_card, _listing_product, _card_record.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from abc import abstractmethod
+from typing import Any, AsyncIterator, Awaitable, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+from source.application.parser_interface import BaseParser, ResultSink
+from source.core.config import settings
+from source.core.dto import ParseResult, ProductDetail, Task
+from source.infra.catalog_cache import CatalogRecord, catalog_cache, is_stale
+from source.infra.request_policy import RequestStats
+from source.utils.concurrency import BoundedTaskPool
+
+logger = logging.getLogger("incremental")
+
+# Товар из листинга: ключ в каталоге, элемент листинга, категория
+Entry = Tuple[str, dict, str]
+
+
+class IncrementalParser(BaseParser):
+    SERVICE: str
+    card_concurrency: int
+    # Объявляется в каждом парсере, чтобы close() одного не трогал фон другого
+    _background_tasks: set
+
+    @abstractmethod
+    async def _open_incremental(self, task: Task, r: redis.Redis) -> Any:
+        pass
+
+    async def _close_incremental(self, scope: Any) -> None:
+        pass
+
+    @abstractmethod
+    def _incremental_pages(self, scope: Any, r: redis.Redis) -> AsyncIterator[List[Entry]]:
+        pass
+
+    @abstractmethod
+    def _incremental_card(self, scope: Any, item: dict, category: str, stats: RequestStats) -> Awaitable[Optional[ProductDetail]]:
+        pass
+
+    @abstractmethod
+    def _listing_product(self, scope: Any, item: dict, category: str, record: Optional[CatalogRecord]) -> ProductDetail:
+        pass
+
+    @abstractmethod
+    def _card_record(self, p: ProductDetail, fingerprint: Optional[str]) -> CatalogRecord:
+        pass
+
+    @abstractmethod
+    def _listing_fingerprint(self, item: dict) -> str:
+        pass
+
+    async def parse_incremental(self, task: Task, r: redis.Redis = None, sink: Optional[ResultSink] = None) -> ParseResult:
+        if r is None:
+            raise ValueError(f"Redis client is required for {self.SERVICE} incremental mode")
+
+        name = self.SERVICE.capitalize()
+        start = time.time()
+        products = []
+        stale = []
+        changed = []
+        listings = {}
+        fingerprints = {}
+        cards = BoundedTaskPool(self.card_concurrency)
+        card_stats = RequestStats()
+        handed_off = False
+
+        scope = await self._open_incremental(task, r)
+        try:
+            try:
+                async for entries in self._incremental_pages(scope, r):
+                    cached = await catalog_cache.get_many(r, self.SERVICE, [key for key, _, _ in entries])
+
+                    page = []
+                    for key, item, category in entries:
+                        fingerprints[key] = self._listing_fingerprint(item)
+                        record = cached.get(key)
+                        if record is None or record.get("fingerprint") != fingerprints[key]:
+                            changed.append(key)
+                            listings[key] = (item, category, record)
+                            cards.submit(self._incremental_card(scope, item, category, card_stats))
+                            continue
+
+                        page.append(self._listing_product(scope, item, category, record))
+                        if is_stale(record, settings.CATALOG_MAX_AGE):
+                            stale.append((key, item, category))
+                    await self.emit(sink, page, products)
+
+            except Exception as e:
+                logger.error("%s incremental fatal error: %s", name, e, exc_info=True)
+
+            fetched = await self._collect_cards(cards, changed, sink)
+            if sink is None:
+                products.extend(card for _, card in fetched)
+            # Карточка не пришла — товар всё равно в выдаче, как в fast; в каталог он не пишется
+            fetched_keys = {key for key, _ in fetched}
+            fallback = [
+                self._listing_product(scope, item, category, record)
+                for key, (item, category, record) in listings.items() if key not in fetched_keys
+            ]
+            await self.emit(sink, fallback, products)
+            try:
+                await self._save_cards(r, fetched, fingerprints)
+            except Exception as e:
+                logger.error("%s incremental | ошибка записи каталога в Redis: %s", name, e)
+
+            if stale:
+                self._spawn_background(self._refresh_stale(scope, stale, fingerprints, r))
+                handed_off = True
+        finally:
+            if not handed_off:
+                await self._close_incremental(scope)
+
+        took = round(time.time() - start, 1)
+        logger.info(
+            "%s incremental | товаров: %d | новых/изменённых: %d | без карточки: %d | устаревших в фоне: %d | %.1fс",
+            name, len(products), len(fetched), len(fallback), len(stale), took
+        )
+
+        return ParseResult(
+            task_id=task.task_id,
+            service=self.SERVICE,
+            mode="incremental",
+            products=products,
+            took_seconds=took,
+            user_id=task.user_id,
+            chat_id=task.chat_id,
+            stats=card_stats.as_dict()
+        )
+
+    async def _collect_cards(self, cards: BoundedTaskPool, keys: list, sink: Optional[ResultSink] = None) -> list[tuple[str, ProductDetail]]:
+        # Карточки нужны целиком для кэшей; в sink они уходят сразу по готовности
+        collected = []
+        async for i, card in cards.as_completed():
+            if isinstance(card, BaseException):
+                logger.warning("%s | ошибка карточки %s: %s", self.SERVICE.capitalize(), keys[i], card)
+            elif card is not None:
+                collected.append((i, keys[i], card))
+                if sink is not None:
+                    await sink.add([card])
+        collected.sort(key=lambda row: row[0])
+        return [(key, card) for _, key, card in collected]
+
+    async def _save_cards(self, r: redis.Redis, fetched: list, fingerprints: dict) -> None:
+        await catalog_cache.put_many(r, self.SERVICE, {
+            key: self._card_record(card, fingerprints.get(key)) for key, card in fetched
+        })
+
+    def _spawn_background(self, coro) -> None:
+        # Контекст задачи (аренда прокси Kuper) в фон не переносится: всё нужное фону лежит в scope
+        bg_task = asyncio.create_task(coro, context=contextvars.Context())
+        self._background_tasks.add(bg_task)
+        bg_task.add_done_callback(self._background_tasks.discard)
+
+    async def _refresh_stale(self, scope: Any, stale: list, fingerprints: dict, r: redis.Redis):
+        name = self.SERVICE.capitalize()
+        start = time.time()
+        try:
+            cards = BoundedTaskPool(self.card_concurrency)
+            card_stats = RequestStats()
+            for _, item, category in stale:
+                cards.submit(self._incremental_card(scope, item, category, card_stats))
+            fetched = await self._collect_cards(cards, [key for key, _, _ in stale])
+            await self._save_cards(r, fetched, fingerprints)
+            logger.info(
+                "%s | фоновое обновление каталога: %d/%d | %.1fс | запросы: %s",
+                name, len(fetched), len(stale), time.time() - start, card_stats.as_dict()
+            )
+        except Exception as e:
+            logger.error("%s | ошибка фонового обновления каталога: %s", name, e, exc_info=True)
+        finally:
+            await self._close_incremental(scope)
+
+    async def close(self) -> None:
+        # Фоновые обновления держат сессии и аренды прокси — завершаем их до закрытия пулов.
+        # Короткое ожидание заодно даёт стартовать только что созданным задачам: отменённая
+        # до первого шага корутина не доходит до finally и не вернула бы scope.
+        tasks = list(self._background_tasks)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=settings.BACKGROUND_SHUTDOWN_TIMEOUT)
+        for bg_task in pending:
+            bg_task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.warning("%s | прервано фоновых обновлений каталога: %d", self.SERVICE.capitalize(), len(pending))
@@ -1,23 +1,37 @@
+import contextlib
+import contextvars
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
+from urllib.parse import urlsplit
 import asyncio
 import time
 import random
-import os
-import pandas as pd
+import redis.asyncio as redis
 
-from source.application.parser_interface import BaseParser
+from source.application.parser_interface import ResultSink
 from source.core.dto import Task, ParseResult, ProductID, ProductDetail
 from source.infra.tls_client import TLSClient
 from source.core.config import settings
 from source.infra.geo import get_coords_by_city 
-from source.utils.parse_coords import parse_city_or_coords
+from source.infra.heavy_cache import heavy_cache, save_heavy_csv
+from source.infra.incremental import IncrementalParser
+from source.infra.catalog_cache import catalog_cache, listing_fingerprint
+from source.infra.shared_cache import SharedCache
+from source.infra.rate_limiter import rate_limiter
+from source.infra.request_policy import RequestPolicy, RequestStats, RetryableStatus, RETRYABLE_STATUSES
+from source.infra.proxy_manager import ProxyManager, proxy_response_ok
+from source.utils.parse_coords import parse_city_or_coords, snap_coords
+from source.utils.pagination import paginate
+from source.utils.offload import run_blocking
 from async_tls_client.session.session import AsyncSession
 
 logger = logging.getLogger("kuper_parser")
 
+# Прокси, арендованный текущей задачей; None — прямое подключение
+_task_proxy: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("kuper_task_proxy", default=None)
 
-class KuperParser(BaseParser):
+
+class KuperParser(IncrementalParser):
     BASE_URL = "https://api.kuper.ru/v2"
 
     HEADERS = {
@@ -33,62 +47,167 @@ class KuperParser(BaseParser):
             'screenname': 'MultiRetailSearch',
         }
     
-    session = AsyncSession(
-            client_identifier="chrome_120",
-            random_tls_extension_order=True
-        )
+    # Сессии создаются при первом запросе, а не при импорте модуля
+    _direct_session: Optional[AsyncSession] = None
+    _extra_sessions: Dict[tuple, AsyncSession] = {}
+
+    proxy_manager = ProxyManager(
+        "kuper", settings.PROXY_LEASE_TTL, settings.PROXY_QUARANTINE_AFTER, settings.PROXY_QUARANTINE_SECONDS
+    )
+    card_policy = RequestPolicy(
+        settings.CARD_RETRIES, settings.CARD_BACKOFF_BASE, settings.CARD_BACKOFF_MAX, settings.CARD_DEADLINE,
+        hedge=settings.CARD_HEDGE, hedge_quantile=settings.CARD_HEDGE_QUANTILE,
+    )
+    # Ошибка страницы листинга не должна выглядеть как конец категории
+    page_policy = RequestPolicy(
+        settings.PAGE_RETRIES, settings.CARD_BACKOFF_BASE, settings.CARD_BACKOFF_MAX, settings.CARD_DEADLINE,
+    )
+
+    def _session_for(self, proxy: Optional[str], hedge: bool = False) -> AsyncSession:
+        if proxy is None and not hedge:
+            if KuperParser._direct_session is None:
+                KuperParser._direct_session = AsyncSession(client_identifier="chrome_120", random_tls_extension_order=True)
+            return KuperParser._direct_session
+        # Отдельные соединения: на каждый прокси и ещё по одному для hedge-запросов
+        key = (proxy, hedge)
+        session = self._extra_sessions.get(key)
+        if session is None:
+            session = AsyncSession(client_identifier="chrome_120", random_tls_extension_order=True)
+            if proxy:
+                session.proxies = {"http": proxy, "https": proxy}
+            self._extra_sessions[key] = session
+        return session
+
+    async def _get(self, url: str, hedge: bool = False, admitted: bool = False, **kwargs):
+        # admitted: токен лимитера уже взят в _admit, до начала дедлайна попытки
+        proxy = _task_proxy.get()
+        if not admitted:
+            await rate_limiter.acquire(url, proxy)
+        started = time.monotonic()
+        try:
+            resp = await self._session_for(proxy, hedge).get(url, **kwargs)
+        except Exception:
+            await self.proxy_manager.record(proxy, ok=False)
+            raise
+        rate_limiter.observe(url, proxy, resp.status, getattr(resp, "headers", None))
+        await self.proxy_manager.record(proxy, ok=proxy_response_ok(resp.status), latency=time.monotonic() - started)
+        return resp
     
-    @property
-    def heavy_csv_path(self) -> str:
-        store = (getattr(self, "current_store", "") or "unknown").lower()
+    def heavy_csv_path(self, store_name: str) -> str:
+        store = (store_name or "unknown").lower()
         return f"{settings.DATA_DIR}/kuper_heavy_{store}.csv"
 
-    current_store: str = ""
+    DEFAULT_COORDS = (55.7558, 37.6173)
+
+    SERVICE = "kuper"
+    card_concurrency = settings.KUPER_HOST_CONCURRENCY
+    _host_semaphores: Dict[str, asyncio.Semaphore] = {}
+    _background_tasks: set = set()
+
+    # Пустой ответ /stores кэшируем явной заглушкой: None в SharedCache читается как промах
+    _STORE_NOT_FOUND = {"miss": True}
+
+    store_cache = SharedCache("kuper:store", settings.KUPER_STORE_TTL, lock_timeout=settings.KUPER_CACHE_LOCK_TIMEOUT)
+    taxon_cache = SharedCache("kuper:taxons", settings.KUPER_TAXONS_TTL, lock_timeout=settings.KUPER_CACHE_LOCK_TIMEOUT)
 
-    async def _get_store_id(self, lat, lon, store_name: str) -> str:
+    async def _get_store_id(self, lat, lon, store_name: str, r: redis.Redis = None):
+        # Магазин в пределах одной ячейки сетки один и тот же — запрос /stores делаем раз на ячейку
+        lat, lon = snap_coords(lat, lon, settings.KUPER_STORE_GRID)
+        result = await self.store_cache.get_or_load(
+            r,
+            (f"{lat:.4f}", f"{lon:.4f}", store_name.lower()),
+            lambda: self._load_store(lat, lon, store_name),
+            ttl=lambda value: 60 if isinstance(value, dict) and value.get("miss") else None,
+        )
+        if isinstance(result, dict) and result.get("miss"):
+            return None
+        return tuple(result) if result else None
+
+    async def _load_store(self, lat, lon, store_name: str):
+        return await self._fetch_store(lat, lon, store_name) or self._STORE_NOT_FOUND
+
+    async def _get_taxons(self, store_id, r: redis.Redis = None) -> list:
+        return await self.taxon_cache.get_or_load(
+            r, (store_id,), lambda: self._fetch_taxons(store_id), ttl=lambda value: None if value else 60
+        )
+
+    @staticmethod
+    def _checked_json(resp, key: str) -> dict:
+        # Ошибка или капча не должны попасть в общий кэш как «магазина нет» или «категорий нет»
+        if resp.status != 200:
+            raise RuntimeError(f"Kuper /{key} ответил {resp.status}")
+        data = resp.json()
+        if not isinstance(data, dict) or key not in data:
+            raise RuntimeError(f"Kuper /{key}: нет поля {key} в ответе")
+        return data
+
+    async def _fetch_taxons(self, store_id) -> list:
+        resp = await self._get(f"{self.BASE_URL}/taxons", params={"sid": store_id}, headers=self.HEADERS)
+        data = self._checked_json(resp, "taxons")
+        taxons = data["taxons"] or []
+        return [{"id": t["id"], "name": t.get("name", "")} for t in taxons if "id" in t]
+
+    async def _fetch_store(self, lat, lon, store_name: str):
         params = {'shipping_method': 'by_courier', 'lat': str(lat), 'lon': str(lon), 'include_labels_tree': 'true'}
-        resp = await self.session.get(f"{self.BASE_URL}/stores", params=params, headers=self.HEADERS)
-        stores = resp.json().get("stores", [])
+        resp = await self._get(f"{self.BASE_URL}/stores", params=params, headers=self.HEADERS)
+        stores = self._checked_json(resp, "stores")["stores"] or []
         store_key = store_name.lower()
         for store in stores:
             if store_key in store.get("name", "").lower():
                 return (store["id"], store.get("name", ""))
         return (stores[0]["id"], stores[0]["name"]) if stores else None
     
-    async def parse(self, task: Task) -> ParseResult:
-        if task.mode == "fast":
-            return await self.parse_fast(task)
-        elif task.mode == "heavy":
-            return await self.parse_heavy(task)
-        else:
-            raise ValueError(f"Unknown mode: {task.mode}")
-
-    async def parse_fast(self, task: Task) -> ParseResult:
+    async def _city_coords(self, city_name: str, r: redis.Redis = None) -> tuple[float, float]:
+        coords = await get_coords_by_city(city_name, r)
+        if coords is None:
+            logger.warning("Kuper | город %s не найден, используем Москву", city_name)
+            return self.DEFAULT_COORDS
+        return coords
+
+    async def parse(self, task: Task, redis_client: redis.Redis = None, sink: Optional[ResultSink] = None) -> ParseResult:
+        lease = None
+        if settings.KUPER_PROXY_LIST and redis_client is not None:
+            lease = await self.proxy_manager.acquire(redis_client)
+            if lease is None:
+                logger.warning("Kuper: нет свободных здоровых прокси, прямое подключение")
+        token = _task_proxy.set(lease.proxy if lease else None)
+        try:
+            if task.mode == "fast":
+                return await self.parse_fast(task, redis_client, sink)
+            elif task.mode == "heavy":
+                return await self.parse_heavy(task, redis_client, sink)
+            elif task.mode == "incremental":
+                return await self.parse_incremental(task, redis_client, sink)
+            else:
+                raise ValueError(f"Unknown mode: {task.mode}")
+        finally:
+            _task_proxy.reset(token)
+            await self.proxy_manager.release(lease)
+
+    async def parse_fast(self, task: Task, r: redis.Redis = None, sink: Optional[ResultSink] = None) -> ParseResult:
             start = time.time()
             products = []
-            self.current_store = (task.store or "лента").lower().strip()
-            city = task.city.strip() or "москва"
+            store_name = (task.store or "лента").lower().strip()
             city_name, lat, lon = parse_city_or_coords(task.city)
             if lat is not None and lon is not None:
                 use_lat, use_lon = lat, lon
             else:
-                use_lat, use_lon = await get_coords_by_city(city_name)
+                use_lat, use_lon = await self._city_coords(city_name, r)
 
             logger.error(f"{city_name} {lat} {lon}")
-            heavy_df = None
-            if os.path.exists(self.heavy_csv_path):
-                try:
-                    heavy_df = pd.read_csv(self.heavy_csv_path, sep=";", dtype=str, keep_default_na=False)
-                    heavy_df["sku"] = heavy_df["sku"].str.strip()
-                    logger.error("Kuper fast | кэш загружен: %d товаров", len(heavy_df))
-                except Exception as e:
-                    logger.error("Ошибка чтения кэша: %s", e)
+            heavy_index = None
+            try:
+                heavy_index = await heavy_cache.get(self.heavy_csv_path(store_name), "sku")
+                if heavy_index is not None:
+                    logger.info("Kuper fast | кэш: %d товаров | %s", len(heavy_index), heavy_cache.stats())
+            except Exception as e:
+                logger.error("Ошибка чтения кэша: %s", e)
 
             try:
-                result = await self._get_store_id(use_lat, use_lon, self.current_store)
+                result = await self._get_store_id(use_lat, use_lon, store_name, r)
                 store_id = result[0]
-                self.current_store = result[1]
-                taxons = (await self.session.get(f"{self.BASE_URL}/taxons", params={"sid": store_id}, headers=self.HEADERS)).json().get("taxons", [])
+                store_name = result[1]
+                taxons = await self._get_taxons(store_id, r)
 
                 tasks = []
                 for taxon in taxons:
@@ -99,8 +218,11 @@ class KuperParser(BaseParser):
                         store_id=store_id,
                         tid=taxon["id"],
                         category=name,
-                        heavy_df=heavy_df,
-                        result=products
+                        heavy_index=heavy_index,
+                        result=products,
+                        store_name=store_name,
+                        redis_client=r,
+                        sink=sink
                     ))
 
                 if tasks:
@@ -110,7 +232,7 @@ class KuperParser(BaseParser):
                 logger.error("Kuper fast error: %s", e, exc_info=True)
 
             took = round(time.time() - start, 1)
-            logger.error("Kuper fast | %d товаров | %.1fс | кэш: %s", len(products), took, "ДА" if heavy_df is not None else "НЕТ")
+            logger.error("Kuper fast | %d товаров | %.1fс | кэш: %s", len(products), took, "ДА" if heavy_index is not None else "НЕТ")
 
             return ParseResult(
                 task_id=task.task_id,
@@ -122,150 +244,258 @@ class KuperParser(BaseParser):
                 chat_id=task.chat_id
             )
 
-    async def _fetch_fast(self, store_id: str, tid: str, category: str, heavy_df, result: list):
-        offset = 0
-        while True:
-            params = {"sid": store_id, "tid": tid, "limit": "24", "products_offset": str(offset), "sort": "popularity"}
-            resp = await self.session.get(f"{self.BASE_URL}/catalog/entities", params=params, headers=self.HEADERS)
-            if resp.status != 200 or not resp.json().get("entities"):
-                break
+    async def _fetch_entities_page(self, store_id: str, tid: str, offset: int) -> tuple[list, Optional[int]]:
+        params = {
+            "sid": store_id,
+            "tid": tid,
+            "limit": str(settings.KUPER_PAGE_LIMIT),
+            "products_offset": str(offset),
+            "sort": "popularity",
+        }
+        url = f"{self.BASE_URL}/catalog/entities"
+
+        async def attempt(hedged: bool):
+            resp = await self._get(url, admitted=True, params=params, headers=self.HEADERS)
+            if resp.status in RETRYABLE_STATUSES:
+                raise RetryableStatus(resp.status)
+            return resp
+
+        resp = await self.page_policy.call(attempt, gate=lambda hedged: self._paced(url))
+        if resp.status != 200:
+            return [], None
+        data = resp.json()
+        return data.get("entities") or [], self._entities_total(data)
+
+    @staticmethod
+    def _entities_total(data: dict) -> Optional[int]:
+        meta = data.get("meta") or {}
+        for source in (meta, data):
+            for field in ("total_count", "products_count", "total"):
+                value = source.get(field)
+                if isinstance(value, int):
+                    return value
+        return None
+
+    def _entity_pages(self, store_id: str, tid: str):
+        return paginate(
+            lambda offset: self._fetch_entities_page(store_id, tid, offset),
+            page_size=settings.KUPER_PAGE_LIMIT,
+            window=settings.KUPER_PAGE_WINDOW,
+        )
+
+    def _listing_fingerprint(self, e: dict) -> str:
+        # Каталог общий для всех магазинов (ключ — SKU), а цена у каждого ритейлера своя:
+        # с ценой в отпечатке прогоны по разным магазинам сбрасывали бы записи друг друга
+        return listing_fingerprint(e.get("name"), e.get("human_volume"))
+
+    def _product_from_listing(self, e: dict, category: str, record: Optional[dict], store_name: str) -> ProductDetail:
+        region_id = str(e["id"])
+
+        name = e.get("name", "Без названия")
+        price = e.get("price", 0)
+        old_price = e.get("original_price")
+        weight = e.get("human_volume") or f"{e.get('grams_per_unit', '')} г"
+        photos = [img.get("original_url", "") for img in e.get("images", []) if img.get("original_url")]
+        stock = e.get("stock", 0) or e.get("stock_info", {}).get("quantity", 0)
+        in_stock = bool(stock > 0)
+
+        calories = proteins = fats = carbs = ingredients = None
+        if record is not None:
+            calories = record.get("calories")
+            proteins = record.get("proteins")
+            fats = record.get("fats")
+            carbs = record.get("carbs")
+            ingredients = record.get("ingredients")
+
+        return ProductDetail(
+            product_id=region_id,  
+            name=name,
+            price=price,
+            old_price=old_price,
+            calories=calories,
+            proteins=proteins,
+            fats=fats,
+            carbs=carbs,
+            weight=weight,
+            ingredients=ingredients,
+            photos=photos,
+            category=category,
+            store=store_name.capitalize(),
+            in_stock=in_stock
+        )
 
-            for e in resp.json()["entities"]:
+    async def _fetch_fast(self, store_id: str, tid: str, category: str, heavy_index, result: list, store_name: str, redis_client: redis.Redis = None, sink: Optional[ResultSink] = None):
+        async for entities in self._entity_pages(store_id, tid):
+            cached = {}
+            if redis_client is not None:
+                try:
+                    cached = await catalog_cache.get_many(redis_client, "kuper", [str(e.get("sku") or "") for e in entities])
+                except Exception as exc:
+                    logger.warning("Kuper fast | каталог в Redis недоступен: %s", exc)
 
+            page = []
+            for e in entities:
                 sku = str(e.get("sku") or "")
-                region_id = str(e["id"])
-
-                name = e.get("name", "Без названия")
-                price = e.get("price", 0)
-                old_price = e.get("original_price")
-                weight = e.get("human_volume") or f"{e.get('grams_per_unit', '')} г"
-                photos = [img.get("original_url", "") for img in e.get("images", []) if img.get("original_url")]
-                stock = e.get("stock", 0) or e.get("stock_info", {}).get("quantity", 0)
-                in_stock = bool(stock > 0)
-
-                calories = proteins = fats = carbs = ingredients = None
-                if heavy_df is not None and sku:
-                    match = heavy_df[heavy_df["sku"] == sku]
-                    if not match.empty:
-                        r = match.iloc[0]
-                        calories = r.get("calories")
-                        proteins = r.get("proteins")
-                        fats = r.get("fats")
-                        carbs = r.get("carbs")
-                        ingredients = r.get("ingredients")
-
-                result.append(ProductDetail(
-                    product_id=region_id,  
-                    name=name,
-                    price=price,
-                    old_price=old_price,
-                    calories=calories,
-                    proteins=proteins,
-                    fats=fats,
-                    carbs=carbs,
-                    weight=weight,
-                    ingredients=ingredients,
-                    photos=photos,
-                    category=category,
-                    store=self.current_store.capitalize(),
-                    in_stock=in_stock
-                ))
-
-            offset += 24
-
-    async def parse_heavy(self, task: Task) -> ParseResult:
-        self.current_store = (task.store or "лента").lower().strip()
+                record = cached.get(sku) if sku else None
+                if record is None and heavy_index is not None and sku:
+                    record = heavy_index.get(sku)
+                page.append(self._product_from_listing(e, category, record, store_name))
+            await self.emit(sink, page, result)
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max(1, settings.KUPER_HOST_CONCURRENCY))
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    @contextlib.asynccontextmanager
+    async def _paced(self, url: str):
+        await rate_limiter.acquire(url, _task_proxy.get())
+        yield
+
+    @contextlib.asynccontextmanager
+    async def _admit(self, url: str):
+        async with self._host_semaphore(url), self._paced(url):
+            yield
+
+    async def _fetch_card(self, e: dict, cat_name: str, store_name: str, stats: RequestStats = None) -> Optional[ProductDetail]:
+        region_id = str(e["id"])
+        url = f"{self.BASE_URL}/multicards/{region_id}"
+
+        async def attempt(hedged: bool):
+            card_resp = await self._get(url, hedge=hedged, admitted=True, headers=self.HEADERS)
+            if card_resp.status in RETRYABLE_STATUSES:
+                raise RetryableStatus(card_resp.status)
+            if card_resp.status != 200:
+                return None
+            return card_resp.json().get("product", {})
+
+        data = await self.card_policy.call(attempt, stats, gate=lambda hedged: self._admit(url))
+        if data is None:
+            return None
+
+        props = {p["name"]: p["value"] for p in data.get("properties", [])}
+        stock = data.get("stock", 0) or data.get("stock_info", {}).get("quantity", 0)
+        in_stock = bool(stock > 0)
+
+        return ProductDetail(
+            product_id=region_id,  
+            name=data.get("name") or e.get("name"),
+            price=(data.get("price") or 0),
+            old_price=(data.get("original_price") or 0) if data.get("original_price") else None,
+            calories=props.get("energy_value", "").replace(" ккал", "").strip() or None,
+            proteins=props.get("protein", "").replace(" г", "").strip() or None,
+            fats=props.get("fat", "").replace(" г", "").strip() or None,
+            carbs=props.get("carbohydrate", "").replace(" г", "").strip() or None,
+            weight=data.get("human_volume") or e.get("human_volume") or f"{e.get('grams_per_unit', '')} г",
+            ingredients=props.get("ingredients") or data.get("description", ""),
+            photos=[img.get("original_url", "") for img in data.get("images", []) if img.get("original_url")],
+            category=cat_name,
+            store=store_name.capitalize(),
+            in_stock=in_stock
+        )
+
+    async def parse_heavy(self, task: Task, r: redis.Redis = None, sink: Optional[ResultSink] = None) -> ParseResult:
+        store_name = (task.store or "лента").lower().strip()
         start = time.time()
         detailed = []
+        cache_rows = []
+        fingerprints = {}
+        queued = 0
+        listing_complete = False
+
+        workers_count = max(1, settings.KUPER_HOST_CONCURRENCY)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers_count * 4)
+        card_stats = RequestStats()
+
+        async def card_worker():
+            while True:
+                item = await queue.get()
+                try:
+                    if item is None:
+                        return
+                    e, sku, cat_name = item
+                    product = await self._fetch_card(e, cat_name, store_name, card_stats)
+                    if product is None:
+                        continue
+                    await self.emit(sink, [product], detailed)
+                    cache_rows.append({
+                        "sku": sku,
+                        "calories": product.calories,
+                        "proteins": product.proteins,
+                        "fats": product.fats,
+                        "carbs": product.carbs,
+                        "ingredients": product.ingredients,
+                    })
+                except Exception as exc:
+                    logger.warning("Kuper heavy | ошибка карточки %s: %s", item[0].get("id"), exc)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(card_worker()) for _ in range(workers_count)]
 
         try:
-            lat = 55.7558 
-            lon = 37.6173
-            result = await self._get_store_id(lat, lon, self.current_store)
+            lat, lon = self.DEFAULT_COORDS
+            result = await self._get_store_id(lat, lon, store_name, r)
             store_id = result[0]
-            self.current_store = result[1]
-            taxons_resp = await self.session.get(f"{self.BASE_URL}/taxons", params={"sid": store_id}, headers=self.HEADERS)
-            taxons = taxons_resp.json().get("taxons", [])
-
-            cache_rows = []
+            store_name = result[1]
+            taxons = await self._get_taxons(store_id, r)
 
             for taxon in taxons:
                 cat_name = taxon.get("name", "")
                 if not any(kw in cat_name.lower() for kw in ["готовая еда"]):
                     continue
 
-                offset = 0
-                while True:
-                    entities_resp = await self.session.get(f"{self.BASE_URL}/catalog/entities", params={
-                        "sid": store_id,
-                        "tid": taxon["id"],
-                        "limit": "24",
-                        "products_offset": str(offset),
-                        "sort": "popularity"
-                    }, headers=self.HEADERS)
-
-                    entities = entities_resp.json().get("entities", [])
-                    if not entities:
-                        break
-
+                async for entities in self._entity_pages(store_id, taxon["id"]):
                     for e in entities:
                         if e.get("type") != "product":
                             continue
 
-                        region_id = str(e["id"])
                         sku = str(e.get("sku") or "")
                         if not sku or sku == "None" or sku == "nan":
                             continue 
 
-                        card_resp = await self.session.get(f"{self.BASE_URL}/multicards/{region_id}", headers=self.HEADERS)
-                        if card_resp.status != 200:
-                            continue
-                        data = card_resp.json().get("product", {})
-
-                        props = {p["name"]: p["value"] for p in data.get("properties", [])}
-                        stock = data.get("stock", 0) or data.get("stock_info", {}).get("quantity", 0)
-                        in_stock = bool(stock > 0)
-
-                        product = ProductDetail(
-                            product_id=region_id,  
-                            name=data.get("name") or e.get("name"),
-                            price=(data.get("price") or 0),
-                            old_price=(data.get("original_price") or 0) if data.get("original_price") else None,
-                            calories=props.get("energy_value", "").replace(" ккал", "").strip() or None,
-                            proteins=props.get("protein", "").replace(" г", "").strip() or None,
-                            fats=props.get("fat", "").replace(" г", "").strip() or None,
-                            carbs=props.get("carbohydrate", "").replace(" г", "").strip() or None,
-                            weight=data.get("human_volume") or e.get("human_volume") or f"{e.get('grams_per_unit', '')} г",
-                            ingredients=props.get("ingredients") or data.get("description", ""),
-                            photos=[img.get("original_url", "") for img in data.get("images", []) if img.get("original_url")],
-                            category=cat_name,
-                            store=self.current_store.capitalize(),
-                            in_stock=in_stock
-                        )
-                        detailed.append(product)
-
-                        cache_rows.append({
-                            "sku": sku,
-                            "calories": product.calories,
-                            "proteins": product.proteins,
-                            "fats": product.fats,
-                            "carbs": product.carbs,
-                            "ingredients": product.ingredients,
-                        })
-
-                    offset += 24
-
-            if cache_rows:
-                cache_df = pd.DataFrame(cache_rows)
-                cache_df.drop_duplicates(subset=["sku"], keep="last", inplace=True)
-                os.makedirs(settings.DATA_DIR, exist_ok=True)
-                cache_df.to_csv(self.heavy_csv_path, sep=";", index=False, encoding="utf-8-sig")
-                logger.error("HEAVY кэш сохранён по SKU: %s | %d товаров", self.heavy_csv_path, len(cache_df))
+                        fingerprints[sku] = self._listing_fingerprint(e)
+                        await queue.put((e, sku, cat_name))
+                        queued += 1
+            listing_complete = True
 
         except Exception as e:
             logger.error("Kuper heavy fatal error: %s", e, exc_info=True)
 
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers, return_exceptions=True)
+
         took = round(time.time() - start, 1)
+        logger.info(
+            "Kuper heavy карточки | %d/%d | %.1fс | %.1f карт/с | параллельно: %d | запросы: %s | лимиты: %s",
+            len(cache_rows), queued, took, len(cache_rows) / took if took > 0 else 0.0, workers_count,
+            card_stats.as_dict(), rate_limiter.stats()
+        )
+
+        if r is not None and cache_rows:
+            try:
+                await catalog_cache.put_many(r, "kuper", {
+                    row["sku"]: {**{k: v for k, v in row.items() if k != "sku"}, "fingerprint": fingerprints.get(row["sku"])}
+                    for row in cache_rows
+                })
+            except Exception as e:
+                logger.error("Kuper heavy | ошибка записи каталога в Redis: %s", e)
+
+        try:
+            if cache_rows and not listing_complete:
+                # Листинг оборвался — неполный набор не должен затереть полный кэш прошлого прогона
+                logger.warning("Kuper heavy | листинг неполный, heavy кэш %s не перезаписан", self.heavy_csv_path(store_name))
+            elif cache_rows:
+                saved = await run_blocking(save_heavy_csv, self.heavy_csv_path(store_name), cache_rows, "sku")
+                logger.error("HEAVY кэш сохранён по SKU: %s | %d товаров", self.heavy_csv_path(store_name), saved)
+
+        except Exception as e:
+            logger.error("Ошибка сохранения кэша Kuper: %s", e, exc_info=True)
+
         return ParseResult(
             task_id=task.task_id,
             service="kuper",
@@ -273,5 +503,64 @@ class KuperParser(BaseParser):
             products=detailed,
             took_seconds=took,
             user_id=task.user_id,
-            chat_id=task.chat_id
-        )
\ No newline at end of file
+            chat_id=task.chat_id,
+            stats=card_stats.as_dict()
+        )
+
+    async def _open_incremental(self, task: Task, r: redis.Redis) -> tuple:
+        store_name = (task.store or "лента").lower().strip()
+        city_name, lat, lon = parse_city_or_coords(task.city)
+        if lat is None or lon is None:
+            lat, lon = await self._city_coords(city_name, r)
+        store = await self._get_store_id(lat, lon, store_name, r)
+        if store is None:
+            raise ValueError(f"Kuper: магазин {store_name} не найден")
+        return store
+
+    async def _incremental_pages(self, scope: tuple, r: redis.Redis):
+        store_id = scope[0]
+        for taxon in await self._get_taxons(store_id, r):
+            cat_name = taxon.get("name", "")
+            if not any(kw in cat_name.lower() for kw in ["готовая еда"]):
+                continue
+
+            async for entities in self._entity_pages(store_id, taxon["id"]):
+                page = []
+                for e in entities:
+                    if e.get("type") != "product":
+                        continue
+                    sku = str(e.get("sku") or "")
+                    if not sku or sku == "None" or sku == "nan":
+                        continue
+                    page.append((sku, e, cat_name))
+                yield page
+
+    def _incremental_card(self, scope: tuple, e: dict, cat_name: str, stats: RequestStats):
+        return self._fetch_card(e, cat_name, scope[1], stats)
+
+    def _listing_product(self, scope: tuple, e: dict, cat_name: str, record: Optional[dict]) -> ProductDetail:
+        return self._product_from_listing(e, cat_name, record, scope[1])
+
+    def _card_record(self, p: ProductDetail, fingerprint: Optional[str]) -> dict:
+        return {
+            "calories": p.calories,
+            "proteins": p.proteins,
+            "fats": p.fats,
+            "carbs": p.carbs,
+            "ingredients": p.ingredients,
+            "fingerprint": fingerprint,
+        }
+
+    async def close(self) -> None:
+        await super().close()
+        sessions = list(self._extra_sessions.values())
+        if KuperParser._direct_session is not None:
+            sessions.append(KuperParser._direct_session)
+        KuperParser._direct_session = None
+        self._extra_sessions.clear()
+        for session in sessions:
+            try:
+                await session.close()
+            except Exception as e:
+                logger.warning("Kuper | ошибка закрытия сессии: %s", e)
+        await self.proxy_manager.close()
@@ -0,0 +1,32 @@
+"""Реестр парсеров: модуль парсера импортируется и экземпляр создаётся при первом обращении."""
+import importlib
+import logging
+import time
+from typing import Dict
+
+from source.application.parser_interface import BaseParser
+
+logger = logging.getLogger("parsers")
+
+PARSERS = {
+    "vkusvill": "source.infra.vkusvill:VkusvillParser",
+    "kuper": "source.infra.kuper:KuperParser",
+}
+
+_instances: Dict[str, BaseParser] = {}
+
+
+def get_parser(service: str) -> BaseParser:
+    parser = _instances.get(service)
+    if parser is None:
+        if service not in PARSERS:
+            raise KeyError(f"Неизвестный сервис: {service}")
+        started = time.perf_counter()
+        module_name, class_name = PARSERS[service].split(":")
+        parser = _instances[service] = getattr(importlib.import_module(module_name), class_name)()
+        logger.info("Парсер %s загружен за %.2fс", service, time.perf_counter() - started)
+    return parser
+
+
+def loaded_parsers() -> Dict[str, BaseParser]:
+    return dict(_instances)
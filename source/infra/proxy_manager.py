@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+
+logger = logging.getLogger("proxy_manager")
+
+_EWMA_ALPHA = 0.3
+_MIN_LATENCY = 0.05
+_PROXY_FAILURE_STATUSES = {403, 407, 429}
+
+
+def proxy_response_ok(status: int) -> bool:
+    # 404 и прочие 4xx — ответ сайта, а не проблема прокси
+    return status < 500 and status not in _PROXY_FAILURE_STATUSES
+
+
+class ProxyLease:
+    __slots__ = ("proxy", "token", "acquired_at")
+
+    def __init__(self, proxy: str, token: str):
+        self.proxy = proxy
+        self.token = token
+        self.acquired_at = time.monotonic()
+
+
+class _LocalStats:
+    __slots__ = ("ok", "err", "latency_sum", "latency_n", "consecutive_errors")
+
+    def __init__(self):
+        self.ok = 0
+        self.err = 0
+        self.latency_sum = 0.0
+        self.latency_n = 0
+        self.consecutive_errors = 0
+
+
+class ProxyManager:
+    """Пул прокси в Redis с арендой, учётом здоровья и карантином.
+
+    proxies:<pool>:all          — SET всех прокси из конфига
+    proxies:<pool>:leases       — ZSET прокси -> время истечения аренды (unix, сек)
+    proxies:<pool>:owners       — HASH прокси -> токен арендатора
+    proxies:<pool>:stats:<p>    — HASH ok, err, latency, fail_rate, strikes, quarantined_until
+
+    Аренда продлевается фоном, пока процесс жив; если воркер упал, прокси
+    освобождается сам через lease_ttl.
+    """
+
+    def __init__(self, pool: str, lease_ttl: float, quarantine_after: int, quarantine_seconds: float):
+        self.pool = pool
+        self.lease_ttl = lease_ttl
+        self.quarantine_after = max(1, quarantine_after)
+        self.quarantine_seconds = quarantine_seconds
+        self._redis: Optional[redis.Redis] = None
+        self._leases: Dict[str, ProxyLease] = {}
+        self._local: Dict[str, _LocalStats] = {}
+        self._maintenance: Optional[asyncio.Task] = None
+
+    def _key(self, *parts: str) -> str:
+        return ":".join(["proxies", self.pool, *parts])
+
+    async def register(self, r: redis.Redis, proxies: Iterable[str]) -> int:
+        # Конфиг — источник истины: новые прокси добавляем, исчезнувшие убираем
+        proxies = list(dict.fromkeys(proxies))
+        all_key = self._key("all")
+        known = {p.decode() if isinstance(p, bytes) else p for p in await r.smembers(all_key)}
+        removed = known - set(proxies)
+        async with r.pipeline(transaction=False) as pipe:
+            if proxies:
+                pipe.sadd(all_key, *proxies)
+            if removed:
+                pipe.srem(all_key, *removed)
+                pipe.zrem(self._key("leases"), *removed)
+                pipe.hdel(self._key("owners"), *removed)
+            await pipe.execute()
+        added = len(set(proxies) - known)
+        logger.info("Прокси %s: %d в конфиге, %d новых, %d удалено", self.pool, len(proxies), added, len(removed))
+        return added
+
+    async def acquire(self, r: redis.Redis) -> Optional[ProxyLease]:
+        self._redis = r
+        self._ensure_maintenance()
+        candidates = await self._candidates(r)
+        for proxy in candidates:
+            token = uuid.uuid4().hex
+            if await self._try_lease(r, proxy, token):
+                lease = ProxyLease(proxy, token)
+                self._leases[token] = lease
+                return lease
+        return None
+
+    async def release(self, lease: Optional[ProxyLease]) -> None:
+        if lease is None or self._leases.pop(lease.token, None) is None or self._redis is None:
+            return
+        leases_key, owners_key = self._key("leases"), self._key("owners")
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(owners_key)
+                owner = await pipe.hget(owners_key, lease.proxy)
+                if owner is None or owner.decode() != lease.token:
+                    await pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.zrem(leases_key, lease.proxy)
+                pipe.hdel(owners_key, lease.proxy)
+                await pipe.execute()
+        except WatchError:
+            # Кто-то менял владельцев одновременно — аренда всё равно истечёт сама
+            logger.debug("Прокси %s: гонка при освобождении", lease.proxy)
+        except Exception as e:
+            logger.warning("Не удалось освободить прокси %s: %s", lease.proxy, e)
+
+    async def record(self, proxy: Optional[str], ok: bool, latency: Optional[float] = None) -> bool:
+        """Учитывает ответ через прокси; True, если прокси только что ушёл в карантин."""
+        if not proxy:
+            return False
+        stats = self._local.setdefault(proxy, _LocalStats())
+        if latency is not None:
+            stats.latency_sum += latency
+            stats.latency_n += 1
+        if ok:
+            stats.ok += 1
+            stats.consecutive_errors = 0
+            return False
+
+        stats.err += 1
+        stats.consecutive_errors += 1
+        if stats.consecutive_errors >= self.quarantine_after and self._redis is not None:
+            stats.consecutive_errors = 0
+            await self._quarantine(self._redis, proxy)
+            return True
+        return False
+
+    async def close(self) -> None:
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            await asyncio.gather(self._maintenance, return_exceptions=True)
+            self._maintenance = None
+        if self._redis is not None:
+            await self._flush_stats(self._redis)
+        for lease in list(self._leases.values()):
+            await self.release(lease)
+
+    async def _candidates(self, r: redis.Redis) -> List[str]:
+        proxies = [p.decode() for p in await r.smembers(self._key("all"))]
+        if not proxies:
+            return []
+
+        now = time.time()
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.zrangebyscore(self._key("leases"), now, "+inf")
+            for proxy in proxies:
+                pipe.hgetall(self._key("stats", proxy))
+            leased_raw, *stats_raw = await pipe.execute()
+        leased = {p.decode() for p in leased_raw}
+
+        free = []
+        for proxy, raw in zip(proxies, stats_raw):
+            if proxy in leased:
+                continue
+            stats = {k.decode(): float(v) for k, v in raw.items()}
+            if stats.get("quarantined_until", 0.0) > now:
+                continue
+            free.append((proxy, stats))
+
+        known = [s["latency"] for _, s in free if "latency" in s]
+        default_latency = sorted(known)[len(known) // 2] if known else 1.0
+
+        # Взвешенная выборка без повторов: быстрые и надёжные прокси чаще первые,
+        # но медленные тоже иногда получают шанс обновить статистику
+        keyed = []
+        for proxy, stats in free:
+            latency = max(stats.get("latency", default_latency), _MIN_LATENCY)
+            weight = max(1.0 - stats.get("fail_rate", 0.0), 0.05) / latency
+            keyed.append((random.random() ** (1.0 / weight), proxy))
+        keyed.sort(reverse=True)
+        return [proxy for _, proxy in keyed]
+
+    async def _try_lease(self, r: redis.Redis, proxy: str, token: str) -> bool:
+        leases_key, owners_key = self._key("leases"), self._key("owners")
+        try:
+            async with r.pipeline(transaction=True) as pipe:
+                await pipe.watch(leases_key)
+                expires = await pipe.zscore(leases_key, proxy)
+                now = time.time()
+                if expires is not None and expires > now:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.zadd(leases_key, {proxy: now + self.lease_ttl})
+                pipe.hset(owners_key, proxy, token)
+                await pipe.execute()
+                return True
+        except WatchError:
+            return False
+
+    async def _renew(self, r: redis.Redis) -> None:
+        if not self._leases:
+            return
+        leases_key, owners_key = self._key("leases"), self._key("owners")
+        leases = list(self._leases.values())
+        owners = await r.hmget(owners_key, [lease.proxy for lease in leases])
+        expires = time.time() + self.lease_ttl
+        async with r.pipeline(transaction=False) as pipe:
+            for lease, owner in zip(leases, owners):
+                if owner is not None and owner.decode() == lease.token:
+                    pipe.zadd(leases_key, {lease.proxy: expires}, xx=True)
+                else:
+                    logger.warning("Прокси %s: аренда потеряна, продление пропущено", lease.proxy)
+            await pipe.execute()
+
+    async def _flush_stats(self, r: redis.Redis) -> None:
+        local, self._local = self._local, {}
+        for proxy, stats in local.items():
+            if not stats.ok and not stats.err:
+                continue
+            key = self._key("stats", proxy)
+            current = await r.hmget(key, ["latency", "fail_rate"])
+            fail_rate = stats.err / (stats.ok + stats.err)
+            if current[1] is not None:
+                fail_rate = _EWMA_ALPHA * fail_rate + (1 - _EWMA_ALPHA) * float(current[1])
+            mapping = {"fail_rate": round(fail_rate, 4)}
+            if stats.latency_n:
+                latency = stats.latency_sum / stats.latency_n
+                if current[0] is not None:
+                    latency = _EWMA_ALPHA * latency + (1 - _EWMA_ALPHA) * float(current[0])
+                mapping["latency"] = round(latency, 4)
+            if stats.ok and not stats.err:
+                mapping["strikes"] = 0
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.hincrby(key, "ok", stats.ok)
+                pipe.hincrby(key, "err", stats.err)
+                pipe.hset(key, mapping=mapping)
+                await pipe.execute()
+
+    async def _quarantine(self, r: redis.Redis, proxy: str) -> None:
+        key = self._key("stats", proxy)
+        try:
+            strikes = await r.hincrby(key, "strikes", 1)
+            # Каждый повторный карантин подряд вдвое длиннее, но не больше 16x
+            duration = self.quarantine_seconds * 2 ** min(strikes - 1, 4)
+            await r.hset(key, "quarantined_until", time.time() + duration)
+            logger.warning("Прокси %s (%s) в карантине на %.0fс", proxy, self.pool, duration)
+        except Exception as e:
+            logger.warning("Не удалось поместить прокси %s в карантин: %s", proxy, e)
+
+    def _ensure_maintenance(self) -> None:
+        if self._maintenance is None or self._maintenance.done():
+            self._maintenance = asyncio.create_task(self._maintenance_loop())
+
+    async def _maintenance_loop(self) -> None:
+        interval = max(1.0, self.lease_ttl / 3)
+        while True:
+            await asyncio.sleep(interval)
+            if self._redis is None:
+                continue
+            try:
+                await self._renew(self._redis)
+                await self._flush_stats(self._redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Обслуживание прокси %s: %s", self.pool, e)
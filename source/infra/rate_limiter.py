@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from source.core.config import settings
+
+logger = logging.getLogger("rate_limiter")
+
+_THROTTLE_STATUSES = {429, 503}
+_MAX_RETRY_AFTER = 300.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), _MAX_RETRY_AFTER)
+
+
+class TokenBucket:
+    """Token bucket с AIMD: успех понемногу поднимает rate, 429/503 режут его вдвое."""
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, burst: float,
+                 increase: float, decrease: float, cooldown: float = 1.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = max(1.0, burst)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.queued = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            # Lock честный (FIFO), так что ожидающие получают токены по очереди
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self._refill(now)
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        break
+                    await asyncio.sleep((1.0 - self.tokens) / self.rate)
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        return waited
+
+    def on_success(self) -> None:
+        # Аддитивный рост: примерно +increase запросов/с за каждую секунду без ошибок
+        self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+
+    def on_throttle(self, retry_after: Optional[float]) -> None:
+        now = time.monotonic()
+        self.throttled += 1
+        self._refill(now)
+        self.tokens = 0.0
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        # Ответы уже летящих запросов не должны обрушить rate несколько раз подряд
+        if now - self.last_decrease >= self.cooldown:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.last_decrease = now
+
+    def stats(self) -> dict:
+        return {
+            "rate": round(self.rate, 2),
+            "queued": self.queued,
+            "throttled": self.throttled,
+            "avg_wait": round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+        }
+
+
+class RateLimiter:
+    def __init__(self, rate: float, min_rate: float, max_rate: float, burst: float,
+                 increase: float, decrease: float):
+        self._params = dict(rate=rate, min_rate=min_rate, max_rate=max_rate, burst=burst,
+                            increase=increase, decrease=decrease)
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def bucket(self, url: str, proxy: Optional[str] = None) -> TokenBucket:
+        key = (urlsplit(url).netloc, proxy or "direct")
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(**self._params)
+            self._buckets[key] = bucket
+        return bucket
+
+    async def acquire(self, url: str, proxy: Optional[str] = None) -> float:
+        return await self.bucket(url, proxy).acquire()
+
+    def observe(self, url: str, proxy: Optional[str], status: int, headers=None) -> None:
+        bucket = self.bucket(url, proxy)
+        if status in _THROTTLE_STATUSES:
+            headers = headers or {}
+            retry_after = parse_retry_after(headers.get("Retry-After") or headers.get("retry-after"))
+            bucket.on_throttle(retry_after)
+            logger.warning("Троттлинг %s (%s): %d, rate -> %.2f/с, пауза %s",
+                           url, proxy or "direct", status, bucket.rate, retry_after)
+        elif status < 500:
+            bucket.on_success()
+
+    def stats(self) -> dict:
+        return {f"{host}|{proxy}": bucket.stats() for (host, proxy), bucket in self._buckets.items()}
+
+
+rate_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_INITIAL,
+    min_rate=settings.RATE_LIMIT_MIN,
+    max_rate=settings.RATE_LIMIT_MAX,
+    burst=settings.RATE_LIMIT_BURST,
+    increase=settings.RATE_LIMIT_INCREASE,
+    decrease=settings.RATE_LIMIT_DECREASE,
+)
@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncContextManager, Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger("request_policy")
+
+T = TypeVar("T")
+
+Gate = Callable[[bool], AsyncContextManager]
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# Ошибки разбора ответа повтором не лечатся
+_NON_RETRYABLE = (KeyError, TypeError, ValueError)
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class RequestStats:
+    __slots__ = ("requests", "retries", "hedges", "hedge_wins", "timeouts", "failures")
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class RequestPolicy:
+    """Повторы с jitter-backoff, дедлайн на попытку и опциональный hedging.
+
+    fn(hedged) создаёт одну попытку; hedged=True означает дублирующий запрос,
+    который вызывающий код должен отправить через другую сессию или прокси.
+    Hedge уходит, если основная попытка не ответила за p-квантиль недавних задержек.
+
+    gate(hedged) — допуск к отправке (семафор хоста, токен rate limiter'а).
+    Ожидание в gate не входит ни в дедлайн попытки, ни в замер задержки:
+    очередь на своей стороне — не повод для повтора или hedge.
+    """
+
+    def __init__(self, retries: int, backoff_base: float, backoff_max: float, deadline: float,
+                 hedge: bool = False, hedge_quantile: float = 0.95, min_samples: int = 20):
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self._latencies: deque = deque(maxlen=500)
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge or len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))]
+
+    async def call(self, fn: Callable[[bool], Awaitable[T]], stats: Optional[RequestStats] = None,
+                   gate: Optional[Gate] = None) -> T:
+        stats = stats if stats is not None else RequestStats()
+        stats.requests += 1
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._attempt(fn, stats, gate)
+            except _NON_RETRYABLE:
+                stats.failures += 1
+                raise
+            except Exception as e:
+                if attempt >= self.retries:
+                    stats.failures += 1
+                    raise
+                stats.retries += 1
+                # Full jitter: повторы разных карточек не приходят к серверу пачкой
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                logger.debug("Повтор %d через %.2fс: %s", attempt + 1, delay, e)
+                await asyncio.sleep(delay)
+
+    async def _with_deadline(self, coro: Awaitable[T], stats: RequestStats) -> T:
+        try:
+            return await asyncio.wait_for(coro, timeout=self.deadline)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise
+
+    async def _send(self, fn: Callable[[bool], Awaitable[T]], hedged: bool, stats: RequestStats,
+                    gate: Optional[Gate], sent: Optional[asyncio.Event] = None) -> T:
+        async with (gate(hedged) if gate is not None else contextlib.nullcontext()):
+            if sent is not None:
+                sent.set()
+            started = time.monotonic()
+            result = await self._with_deadline(fn(hedged), stats)
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+    async def _attempt(self, fn: Callable[[bool], Awaitable[T]], stats: RequestStats, gate: Optional[Gate]) -> T:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._send(fn, False, stats, gate)
+        return await self._hedged(fn, stats, delay, gate)
+
+    async def _hedged(self, fn: Callable[[bool], Awaitable[T]], stats: RequestStats, delay: float,
+                      gate: Optional[Gate]) -> T:
+        sent = asyncio.Event()
+        primary = asyncio.create_task(self._send(fn, False, stats, gate, sent))
+        pending = {primary}
+        try:
+            # Задержка hedge отсчитывается от реальной отправки, а не от постановки в очередь gate
+            waiter = asyncio.create_task(sent.wait())
+            await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if primary.done():
+                return primary.result()
+
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            stats.hedges += 1
+            hedge = asyncio.create_task(self._send(fn, True, stats, gate))
+            pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            stats.hedge_wins += 1
+                        return task.result()
+                    if task is primary or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
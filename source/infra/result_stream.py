@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import List
+
+import redis.asyncio as redis
+
+from source.application.parser_interface import ResultSink
+from source.core.config import settings
+from source.core.dto import Task, ParseResult, ProductDetail
+from source.infra import claim_check
+
+logger = logging.getLogger("result_stream")
+
+
+class RedisResultStream(ResultSink):
+    """Публикует товары в OUTPUT_STREAM пачками по chunk_size.
+
+    Каждая запись помечена kind (chunk/final/aborted), номером seq и run —
+    идентификатором попытки: при повторной доставке задачи бот отбрасывает
+    куски прерванного прогона. Записи без kind — обычный полный результат.
+
+    add() вызывают параллельные воркеры парсера, поэтому публикация идёт
+    под одной блокировкой: seq выдаётся подряд и в порядке xadd.
+    """
+
+    def __init__(self, r: redis.Redis, task: Task, chunk_size: int):
+        self.r = r
+        self.task = task
+        self.chunk_size = max(1, chunk_size)
+        self.run = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.count = 0
+        self.started = time.time()
+        self._buffer: List[ProductDetail] = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def total(self) -> int:
+        # Всё, что прошло через add, включая ещё не отправленный остаток буфера
+        return self.count + len(self._buffer)
+
+    async def add(self, products: List[ProductDetail]) -> None:
+        async with self._lock:
+            self._buffer.extend(products)
+            while len(self._buffer) >= self.chunk_size:
+                chunk, self._buffer = self._buffer[:self.chunk_size], self._buffer[self.chunk_size:]
+                await self._publish("chunk", chunk)
+
+    async def finish(self, result: ParseResult) -> None:
+        async with self._lock:
+            await self._finish(result)
+
+    async def _finish(self, result: ParseResult) -> None:
+        if self._buffer:
+            chunk, self._buffer = self._buffer, []
+            await self._publish("chunk", chunk)
+        # Товары, которые парсер всё же вернул в итоговом результате, тоже уходят кусками
+        for i in range(0, len(result.products), self.chunk_size):
+            await self._publish("chunk", result.products[i:i + self.chunk_size])
+        final = result.model_copy(update={"products": []})
+        await self._xadd("final", final, total=self.count)
+        logger.info("Задача %s: отправлено %d товаров в %d частях", self.task.task_id, self.count, self.seq - 1)
+
+    async def abort(self) -> None:
+        try:
+            async with self._lock:
+                await self._xadd("aborted", self._envelope([]))
+        except Exception as e:
+            logger.warning("Не удалось отметить прерванный поток задачи %s: %s", self.task.task_id, e)
+
+    def _envelope(self, products: list) -> ParseResult:
+        return ParseResult(
+            task_id=self.task.task_id,
+            service=self.task.service,
+            mode=self.task.mode,
+            products=products,
+            took_seconds=round(time.time() - self.started, 1),
+            user_id=self.task.user_id,
+            chat_id=self.task.chat_id,
+        )
+
+    async def _publish(self, kind: str, products: list) -> None:
+        self.count += len(products)
+        await self._xadd(kind, self._envelope(products))
+
+    async def _xadd(self, kind: str, result: ParseResult, **extra) -> None:
+        # Вызывается только под self._lock; seq берётся после упаковки, перед самым xadd
+        packed = await claim_check.pack(self.r, result)
+        self.seq += 1
+        fields = {
+            **packed,
+            "kind": kind,
+            "task_id": self.task.task_id,
+            "run": self.run,
+            "seq": str(self.seq),
+        }
+        fields.update({k: str(v) for k, v in extra.items()})
+        await self.r.xadd(settings.OUTPUT_STREAM, fields)
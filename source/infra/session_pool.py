@@ -0,0 +1,120 @@
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Union
+
+from async_tls_client.session.session import AsyncSession
+
+logger = logging.getLogger("session_pool")
+
+
+class _PooledSession:
+    __slots__ = ("session", "last_used", "users")
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.last_used = time.monotonic()
+        self.users = 0
+
+
+class SessionPool:
+    def __init__(self, max_size: int, idle_ttl: float):
+        self.max_size = max(1, max_size)
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[Hashable, _PooledSession]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _checkout(self, key: Hashable) -> AsyncSession:
+        entry = self._entries[key]
+        entry.users += 1
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(key)
+        return entry.session
+
+    async def acquire(self, key: Hashable, factory: Callable[[], Union[AsyncSession, Awaitable[AsyncSession]]]) -> AsyncSession:
+        await self._evict_idle()
+        if key in self._entries:
+            self.hits += 1
+            return self._checkout(key)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._checkout(key)
+
+            self.misses += 1
+            session = factory()
+            if inspect.isawaitable(session):
+                session = await session
+            self._entries[key] = _PooledSession(session)
+            session = self._checkout(key)
+        await self._evict_overflow()
+        return session
+
+    def release(self, key: Hashable) -> None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.users = max(0, entry.users - 1)
+            entry.last_used = time.monotonic()
+
+    async def discard(self, key: Hashable) -> None:
+        # Сессию, которую ещё кто-то держит, не закрываем: её закроет discard последнего пользователя
+        entry = self._entries.get(key)
+        if entry is not None and not entry.users:
+            del self._entries[key]
+            await self._close(key, entry)
+
+    async def close_all(self) -> None:
+        while self._entries:
+            key, entry = self._entries.popitem(last=False)
+            await self._close(key, entry)
+
+    async def _close(self, key: Hashable, entry: _PooledSession) -> None:
+        lock = self._locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._locks[key]
+        try:
+            await entry.session.close()
+        except Exception as e:
+            logger.warning("Ошибка закрытия сессии %s: %s", key, e)
+
+    async def _evict_idle(self) -> None:
+        now = time.monotonic()
+        expired = [
+            key for key, entry in self._entries.items()
+            if entry.users == 0 and now - entry.last_used > self.idle_ttl
+        ]
+        for key in expired:
+            self.evictions += 1
+            await self._close(key, self._entries.pop(key))
+
+    async def _evict_overflow(self) -> None:
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            entry = self._entries[key]
+            if entry.users:
+                continue
+            del self._entries[key]
+            self.evictions += 1
+            await self._close(key, entry)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate, 3),
+        }
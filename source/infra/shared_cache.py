@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import math
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+import redis.asyncio as redis
+
+logger = logging.getLogger("shared_cache")
+
+
+class SharedCache:
+    def __init__(self, prefix: str, ttl: int, lock_timeout: float = 0.0):
+        self.prefix = prefix
+        self.ttl = ttl
+        # > 0 — промах по ключу загружает только один процесс, остальные ждут его результат в Redis
+        self.lock_timeout = lock_timeout
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def key(self, *parts) -> str:
+        return ":".join([self.prefix, *(str(p) for p in parts)])
+
+    async def get(self, r: Optional[redis.Redis], *parts) -> Optional[Any]:
+        if r is None:
+            return None
+        raw = await r.get(self.key(*parts))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, r: Optional[redis.Redis], value: Any, *parts, ttl: Optional[int] = None) -> None:
+        if r is None:
+            return
+        await r.set(self.key(*parts), json.dumps(value, ensure_ascii=False), ex=ttl or self.ttl)
+
+    async def get_or_load(
+        self,
+        r: Optional[redis.Redis],
+        parts: tuple,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Union[int, Callable[[Any], Optional[int]], None] = None,
+    ) -> Any:
+        key = self.key(*parts)
+        try:
+            cached = await self.get(r, *parts)
+        except Exception as e:
+            logger.warning("Кэш %s недоступен: %s", key, e)
+            cached = None
+        if cached is not None:
+            return cached
+
+        # Одновременные промахи по одному ключу ждут один и тот же запрос
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        locked = False
+        try:
+            if r is not None and self.lock_timeout > 0:
+                locked = await self._acquire_lock(r, key)
+                if not locked:
+                    value = await self._wait_for_peer(r, parts)
+                    if value is not None:
+                        future.set_result(value)
+                        return value
+            value = await loader()
+            try:
+                await self.set(r, value, *parts, ttl=ttl(value) if callable(ttl) else ttl)
+            except Exception as e:
+                logger.warning("Не удалось записать кэш %s: %s", key, e)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if locked:
+                try:
+                    await r.delete(f"{key}:lock")
+                except Exception as e:
+                    logger.warning("Не удалось снять блокировку %s: %s", key, e)
+
+    async def _acquire_lock(self, r: redis.Redis, key: str) -> bool:
+        try:
+            return bool(await r.set(f"{key}:lock", "1", nx=True, ex=math.ceil(self.lock_timeout)))
+        except Exception as e:
+            logger.warning("Блокировка %s недоступна: %s", key, e)
+            return True
+
+    async def _wait_for_peer(self, r: redis.Redis, parts: tuple) -> Optional[Any]:
+        # Другой воркер уже грузит значение — ждём его, но не дольше lock_timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(0.1)
+            try:
+                value = await self.get(r, *parts)
+            except Exception:
+                return None
+            if value is not None:
+                return value
+        return None
@@ -1,21 +1,34 @@
 
+import contextlib
+import weakref
 import logging
 import asyncio
 import time
-import os
-import pandas as pd
 import re
-from typing import Optional
+from typing import Dict, Optional
 
 import redis.asyncio as redis 
-from source.application.parser_interface import BaseParser
+from source.application.parser_interface import ResultSink
 from source.core.dto import Task, ParseResult, ProductDetail
 from source.core.config import settings
+from source.utils.concurrency import BoundedTaskPool
+from source.utils.pagination import paginate
+from source.utils.offload import run_blocking
+from source.infra.heavy_cache import heavy_cache, save_heavy_csv
+from source.infra.incremental import IncrementalParser
+from source.infra.session_pool import SessionPool
+from source.infra.shared_cache import SharedCache
+from source.infra.rate_limiter import rate_limiter
+from source.infra.request_policy import RequestPolicy, RequestStats, RetryableStatus, RETRYABLE_STATUSES
+from source.infra.proxy_manager import ProxyManager, ProxyLease, proxy_response_ok
+from source.utils.parse_coords import snap_coords
+from source.utils.gazetteer import lookup_city
+from source.infra.catalog_cache import catalog_cache, product_to_record, listing_fingerprint
 from async_tls_client.session.session import AsyncSession
 
 logger = logging.getLogger("vkusvill_parser")
 
-class VkusvillParser(BaseParser):
+class VkusvillParser(IncrementalParser):
     BASE_URL = "https://mobile.vkusvill.ru/api"
     HEADERS = {
         "X-Vkusvill-Device": "android",
@@ -29,96 +42,129 @@ class VkusvillParser(BaseParser):
         "Accept-Encoding": "gzip, deflate" 
     }
 
+    CARD_URL = f"{BASE_URL}/catalog4/product"
     HEAVY_CSV_PATH = f"{settings.DATA_DIR}/vkusvill_heavy.csv"
 
-    PROXY_REDIS_KEY = "vkusvill:proxies:free" 
-
-    async def _checkout_proxy(self, r: redis.Redis) -> Optional[str]:
-        proxy = await r.lpop(self.PROXY_REDIS_KEY)
-        if proxy:
-            return proxy.decode()
-        return None
-
-    async def _checkin_proxy(self, r: redis.Redis, proxy: str):
-        if proxy:
-            await r.rpush(self.PROXY_REDIS_KEY, proxy)
-            logger.info("Прокси %s возвращен в очередь.", proxy)
-
-    async def _get_session_for_city(self, city_input: str, r: redis.Redis) -> tuple[AsyncSession, Optional[str]]:
-        key = city_input.strip().lower()
-        lat, lon = None, None
-        proxy = None
-
-        coord_match = re.match(r"^([-\d.]+)[\s,]+([-\d.]+)$", key)
-        if coord_match:
-            lat = float(coord_match.group(1))
-            lon = float(coord_match.group(2))
-        elif key in settings.VKUSVILL_CITY_COORDS:
-            lat, lon = settings.VKUSVILL_CITY_COORDS[key]
-        
-        if lat is None or lon is None:
-            raise ValueError(...)
-
-        if settings.VKUSVILL_PROXY_LIST:
-            proxy = await self._checkout_proxy(r)
-            if not proxy:
-                logger.warning("Нет свободных прокси в очереди. Используется прямое подключение (IP может быть занят).")
-            
-        logger.info(f"ВкусВилл Setup | Geo: {lat},{lon} | Proxy: {proxy if proxy else 'Direct'}")
-        
+    SERVICE = "vkusvill"
+    card_concurrency = settings.VKUSVILL_HEAVY_CONCURRENCY
+    _background_tasks: set = set()
+    _broken_sessions: weakref.WeakSet = weakref.WeakSet()
+    _generations: Dict[tuple, int] = {}
+
+    session_pool = SessionPool(settings.VKUSVILL_SESSION_POOL_SIZE, settings.VKUSVILL_SESSION_IDLE_TTL)
+    shopno_cache = SharedCache("vkusvill:shopno", settings.VKUSVILL_SHOPNO_TTL)
+    proxy_manager = ProxyManager(
+        "vkusvill", settings.PROXY_LEASE_TTL, settings.PROXY_QUARANTINE_AFTER, settings.PROXY_QUARANTINE_SECONDS
+    )
+    card_policy = RequestPolicy(
+        settings.CARD_RETRIES, settings.CARD_BACKOFF_BASE, settings.CARD_BACKOFF_MAX, settings.CARD_DEADLINE,
+        hedge=settings.CARD_HEDGE, hedge_quantile=settings.CARD_HEDGE_QUANTILE,
+    )
+    # Ошибка страницы листинга не должна выглядеть как конец категории
+    page_policy = RequestPolicy(
+        settings.PAGE_RETRIES, settings.CARD_BACKOFF_BASE, settings.CARD_BACKOFF_MAX, settings.CARD_DEADLINE,
+    )
+
+    async def _get(self, session: AsyncSession, url: str, admitted: bool = False, **kwargs):
+        return await self._request(session, "get", url, admitted, **kwargs)
+
+    async def _request(self, session: AsyncSession, method: str, url: str, admitted: bool = False, **kwargs):
+        # Каждый запрос через прокси обновляет его задержку и долю ошибок.
+        # admitted: токен лимитера уже взят в _admit, до начала дедлайна попытки
+        proxy = (getattr(session, "proxies", None) or {}).get("https")
+        if not admitted:
+            await rate_limiter.acquire(url, proxy)
+        started = time.monotonic()
+        try:
+            resp = await getattr(session, method)(url, **kwargs)
+        except Exception:
+            await self.proxy_manager.record(proxy, ok=False)
+            self._broken_sessions.add(session)
+            raise
+        rate_limiter.observe(url, proxy, resp.status, getattr(resp, "headers", None))
+        if await self.proxy_manager.record(proxy, ok=proxy_response_ok(resp.status), latency=time.monotonic() - started):
+            self._broken_sessions.add(session)
+        return resp
+
+    def _pool_key(self, *parts) -> tuple:
+        return (*parts, self._generations.get(parts, 0))
+
+    async def _release_pooled(self, pool_key: tuple, session: AsyncSession) -> None:
+        self.session_pool.release(pool_key)
+        if session in self._broken_sessions:
+            # Ошибка транспорта или прокси в карантине: новые задачи получат свежую сессию,
+            # а эта закроется, когда её отпустит последний пользователь
+            parts, generation = pool_key[:-1], pool_key[-1]
+            self._generations[parts] = max(self._generations.get(parts, 0), generation + 1)
+            await self.session_pool.discard(pool_key)
+
+    def _new_session(self, proxy: Optional[str]) -> AsyncSession:
         session = AsyncSession(
             client_identifier="chrome_120",
             random_tls_extension_order=True
         )
         if proxy:
             session.proxies = {"http": proxy, "https": proxy}
-
+        return session
+
+    async def _resolve_shopno(self, session: AsyncSession, lat: float, lon: float) -> str:
+        params = {
+            'number': '&]ё4464',
+            'shirota': lat,
+            'dolgota': lon,
+            'max_distance': '5875',
+            'kids_room': '0',
+            'project': '0',
+            'with_takeaway': '1',
+            'with_fresh_juice': '0',
+            'with_coffee': '0',
+            'with_bakery': '0',
+            'shop_status': '0',
+            'with_job_interview': '0',
+            'with_pandomat': '0',
+            'with_butcher': '0',
+            'with_cafe': '0',
+            'with_goodcaps': '0',
+            'with_cardscollect': '0',
+            'nopackage': '0',
+            'with_cashpoint': '0',
+            'fishShowcase': '0',
+            'giveFood': '0',
+            'with_ice': '0',
+            'with_wine': '0',
+            'with_help_animals': '0',
+            'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[ShopAddressesFragmentV2]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-23]}{[def_id_service]}{[3]}{[def_type_service]}{[3]}{[def_gettype]}{[0]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6516]}{[def_slot_during]}{[null]}{[def_slot_since]}{[18:00:00]}{[def_slot_until]}{[20:00:00]}{[user_number]}{[&]ё4464]}{[ts]}{[1729691867108]}{[method]}{[/api/stores/getNearbyNew/]}',
+        }
+        resp = await self._get(
+            session,
+            f"{self.BASE_URL}/stores/getNearbyNew/",
+            params=params,
+            headers=self.HEADERS
+        )
+        if resp.status != 200:
+            raise RuntimeError(f"ВкусВилл getNearbyNew ответил {resp.status}")
+        stores = resp.json().get("stores") or []
+        shopno = stores[0].get("ShopNo") if stores else None
+        if shopno is None:
+            # Исключение, а не "None": иначе в общий кэш на сутки попал бы несуществующий магазин
+            raise LookupError(f"ВкусВилл: нет магазина рядом с {lat},{lon}")
+        return str(shopno)
+
+    async def _new_shop_session(self, shopno: str, proxy: Optional[str]) -> AsyncSession:
+        session = self._new_session(proxy)
         try:
             params = {
                 'number': '&]ё4464',
-                'shirota': lat,
-                'dolgota': lon,
-                'max_distance': '5875',
-                'kids_room': '0',
-                'project': '0',
-                'with_takeaway': '1',
-                'with_fresh_juice': '0',
-                'with_coffee': '0',
-                'with_bakery': '0',
-                'shop_status': '0',
-                'with_job_interview': '0',
-                'with_pandomat': '0',
-                'with_butcher': '0',
-                'with_cafe': '0',
-                'with_goodcaps': '0',
-                'with_cardscollect': '0',
-                'nopackage': '0',
-                'with_cashpoint': '0',
-                'fishShowcase': '0',
-                'giveFood': '0',
-                'with_ice': '0',
-                'with_wine': '0',
-                'with_help_animals': '0',
-                'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[ShopAddressesFragmentV2]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-23]}{[def_id_service]}{[3]}{[def_type_service]}{[3]}{[def_gettype]}{[0]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6516]}{[def_slot_during]}{[null]}{[def_slot_since]}{[18:00:00]}{[def_slot_until]}{[20:00:00]}{[user_number]}{[&]ё4464]}{[ts]}{[1729691867108]}{[method]}{[/api/stores/getNearbyNew/]}',
-            }
-            resp = await session.get(
-                f"{self.BASE_URL}/stores/getNearbyNew/",
-                params=params,
-                headers=self.HEADERS
-            )
-            result = resp.json().get("stores")[0]
-            shopno = result.get("ShopNo")
-        
-            params = {
-                'number': '&]ё4464',
-                'shopNo': str(shopno),
+                'shopNo': shopno,
                 'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[ShopAddressesFragmentV2]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-25]}{[def_id_service]}{[3]}{[def_type_service]}{[3]}{[def_gettype]}{[0]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[7660]}{[def_slot_during]}{[null]}{[def_slot_since]}{[11:00:00]}{[def_slot_until]}{[13:00:00]}{[user_number]}{[&]ё4464]}{[ts]}{[1729704763853]}{[method]}{[/api/takeaway/addPickupAddresses/]}',
             }
 
-            await session.get(f"{self.BASE_URL}/takeaway/addPickupAddresses/", params=params, headers=self.HEADERS)
+            resp = await self._get(session, f"{self.BASE_URL}/takeaway/addPickupAddresses/", params=params, headers=self.HEADERS)
+            if resp.status != 200:
+                raise RuntimeError(f"ВкусВилл addPickupAddresses ответил {resp.status}")
             data = {
                 'number': '&]ё4464',
-                'shopNo': str(shopno),
+                'shopNo': shopno,
                 'DateSupply': '20241025',
                 'number_button_chosen': '1',
                 'id_service_chosen': '3',
@@ -131,88 +177,236 @@ class VkusvillParser(BaseParser):
                 'package_id': '0',
                 'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[AddressesFragmentV2]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-25]}{[def_id_service]}{[3]}{[def_type_service]}{[3]}{[def_gettype]}{[0]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[2284]}{[def_slot_during]}{[null]}{[def_slot_since]}{[10:00:00]}{[def_slot_until]}{[12:00:00]}{[user_number]}{[&]ё4464]}{[ts]}{[1729705163318]}{[method]}{[/api/takeaway/updCartHeader/]}',
             }
-            await session.post(f"{self.BASE_URL}/takeaway/updCartHeader/", json=data, headers=self.HEADERS)
-            logger.error(f"ВкусВилл: гео {city_input} | прокси: {'да' if proxy else 'нет'}")
+            resp = await self._request(session, "post", f"{self.BASE_URL}/takeaway/updCartHeader/", json=data, headers=self.HEADERS)
+            if resp.status != 200:
+                raise RuntimeError(f"ВкусВилл updCartHeader ответил {resp.status}")
+        except Exception:
+            await session.close()
+            raise
+        return session
+
+    async def _get_session_for_city(self, city_input: str, r: redis.Redis) -> tuple[AsyncSession, Optional[ProxyLease], tuple]:
+        key = city_input.strip().lower()
+        lat, lon = None, None
+        lease = None
+        proxy = None
+
+        coord_match = re.match(r"^([-\d.]+)[\s,]+([-\d.]+)$", key)
+        if coord_match:
+            lat = float(coord_match.group(1))
+            lon = float(coord_match.group(2))
+        elif key in settings.VKUSVILL_CITY_COORDS:
+            lat, lon = settings.VKUSVILL_CITY_COORDS[key]
+        elif (coords := lookup_city(key)) is not None:
+            lat, lon = coords
+        
+        if lat is None or lon is None:
+            raise ValueError(f"Неизвестный город для ВкусВилл: {city_input}")
+
+        if settings.VKUSVILL_PROXY_LIST:
+            lease = await self.proxy_manager.acquire(r)
+            if lease is None:
+                logger.warning("Нет свободных здоровых прокси. Используется прямое подключение (IP может быть занят).")
+            else:
+                proxy = lease.proxy
+            
+        logger.info(f"ВкусВилл Setup | Geo: {lat},{lon} | Proxy: {proxy if proxy else 'Direct'}")
+
+        try:
+            cell = snap_coords(lat, lon, settings.VKUSVILL_SHOPNO_GRID)
+            shopno = await self.shopno_cache.get_or_load(r, cell, lambda: self._lookup_shopno(lat, lon, proxy))
+            pool_key = self._pool_key(shopno, proxy)
+            session = await self.session_pool.acquire(pool_key, lambda: self._new_shop_session(shopno, proxy))
+            logger.info(f"ВкусВилл: гео {city_input} | магазин {shopno} | прокси: {'да' if proxy else 'нет'} | пул: {self.session_pool.stats()}")
         except Exception as e:
             logger.error(f"Ошибка установки гео ВкусВилл {city_input}: {e}")
+            pool_key = self._pool_key(None, proxy)
+            try:
+                session = await self.session_pool.acquire(pool_key, lambda: self._new_session(proxy))
+            except BaseException:
+                await self.proxy_manager.release(lease)
+                raise
 
-        return session, proxy
+        return session, lease, pool_key
+
+    async def _lookup_shopno(self, lat: float, lon: float, proxy: Optional[str]) -> str:
+        lookup_key = self._pool_key(None, proxy)
+        session = await self.session_pool.acquire(lookup_key, lambda: self._new_session(proxy))
+        try:
+            return await self._resolve_shopno(session, lat, lon)
+        finally:
+            await self._release_pooled(lookup_key, session)
+
+    async def _release_session(self, session: AsyncSession, pool_key: tuple, lease: Optional[ProxyLease]):
+        await self._release_pooled(pool_key, session)
+        await self.proxy_manager.release(lease)
     
-    async def parse(self, task: Task, redis_client: redis.Redis = None) -> ParseResult:
+    async def parse(self, task: Task, redis_client: redis.Redis = None, sink: Optional[ResultSink] = None) -> ParseResult:
         if not redis_client:
             raise ValueError("Redis client is required for Vkusvill parser")
 
         if task.mode == "fast":
-            return await self.parse_fast(task, redis_client)
+            return await self.parse_fast(task, redis_client, sink)
         elif task.mode == "heavy":
-            return await self.parse_heavy(task, redis_client)
+            return await self.parse_heavy(task, redis_client, sink)
+        elif task.mode == "incremental":
+            return await self.parse_incremental(task, redis_client, sink)
         else:
             raise ValueError(f"Unknown mode {task.mode}")
 
-        
+    async def _get_ready_food_categories(self, session: AsyncSession) -> list[tuple[str, str]]:
+        params = {
+            'screen': 'CatalogMain',
+            'number': '&_5>527',
+            'offline': '0',
+            'all_products': 'false',
+            'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[CatalogFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-10]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[56]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6098]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1728539006506]}{[method]}{[/api/bff/get_screen_widgets]}',
+        }
+
+        resp = await self._get(session, f"{self.BASE_URL}/bff/get_screen_widgets", params=params, headers=self.HEADERS)
+        logger.error(f"widgets {resp}")
+        widgets = resp.json().get("widgets", [])
+
+        categories = []
+        for widget in widgets:
+            content_items = widget.get("content", [])
+
+            if not content_items or not isinstance(content_items, list):
+                continue
+
+            for item in content_items:
+                title = item.get("title", "").lower()
+
+                if "готовая еда" in title:
+                    cat_id = item.get("object_id")
+                    if not cat_id:
+                        continue
+
+                    logger.info(f"Найдена категория: {title} (ID: {cat_id})")
+                    categories.append((str(cat_id), title))
+
+        if not categories:
+            logger.warning("Не найдена категория 'Готовая еда' в виджетах")
+        return categories
+
+    async def _fetch_widget_page(self, session: AsyncSession, cat_id: str, offset: int, limit: int = 24) -> list:
+        params = [
+            ('all_products', 'true'),
+            ('data_source', 'Category'),
+            ('object_id', str(cat_id)),
+            ('number', '&_5>527'),
+            ('sort_id', '7'),
+            ('offset', str(offset)),
+            ('limit', str(limit)),
+            ('offline', '0'),
+            ('all_products', 'false'),
+            ('str_par', '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[CatalogMainFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-18]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[4]}{[def_Number_button]}{[1]}{[def_ShopNo]}{[3700]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1729253880342]}{[method]}{[/api/bff/get_widget_content]}'),
+        ]
+
+        url = f"{self.BASE_URL}/bff/get_widget_content"
+
+        async def attempt(hedged: bool):
+            resp = await self._get(session, url, admitted=True, params=params, headers=self.HEADERS)
+            if resp.status in RETRYABLE_STATUSES:
+                raise RetryableStatus(resp.status)
+            return resp
+
+        resp = await self.page_policy.call(attempt, gate=lambda hedged: self._admit(session, url))
+        logger.error(f"page_resp {resp} {offset} {limit} {cat_id}")
+        if resp.status != 200:
+            return []
+        return resp.json() or []
+
+    def _widget_pages(self, session: AsyncSession, cat_id: str):
+        async def fetch(offset: int):
+            return await self._fetch_widget_page(session, cat_id, offset, settings.VKUSVILL_PAGE_LIMIT), None
+
+        return paginate(fetch, page_size=settings.VKUSVILL_PAGE_LIMIT, window=settings.VKUSVILL_PAGE_WINDOW)
+
+    def _listing_fingerprint(self, item: dict) -> str:
+        price_obj = item.get("price", {})
+        return listing_fingerprint(
+            item.get("title"),
+            price_obj.get("price"),
+            price_obj.get("discount_price"),
+            item.get("weight_str"),
+        )
 
-    async def parse_fast(self, task: Task, r: redis.Redis) -> ParseResult:
+    def _product_from_listing(self, item: dict, category: str, record: Optional[dict]) -> ProductDetail:
+        pid = str(item["id"])
+        name = item.get("title", "Без названия")
+
+        price_obj = item.get("price", {})
+        current_price_cents = price_obj.get("discount_price") or price_obj.get("price", 0)
+        base_price_cents = price_obj.get("price", 0)
+        price = current_price_cents
+        old_price = base_price_cents if base_price_cents > current_price_cents else None
+        weight = item.get("weight_str")
+        amount = item.get("amount", 0) or item.get("amount_express", 0)
+        in_stock = bool(amount > 0)
+
+        photos = []
+        images_list = item.get("images", [])
+        large_images_obj = next((img_obj for img_obj in images_list if img_obj.get("type") == "Large"), None)
+        if large_images_obj:
+            photos = [img.get("url", "") for img in large_images_obj.get("images", []) if img.get("url")]
+
+        calories = proteins = fats = carbs = ingredients = None
+        if record is not None:
+            calories = record.get("calories")
+            proteins = record.get("proteins")
+            fats = record.get("fats")
+            carbs = record.get("carbs")
+            ingredients = record.get("ingredients")
+            name = record.get("name") or name
+            photos = record["photos"].split(" | ") if record.get("photos") else photos
+
+        return ProductDetail(
+            product_id=pid,
+            name=name,
+            price=price,
+            old_price=old_price,
+            calories=calories,
+            proteins=proteins,
+            fats=fats,
+            carbs=carbs,
+            weight=weight,
+            ingredients=ingredients,
+            photos=photos,
+            category=category,
+            store="ВкусВилл",
+            in_stock=in_stock
+        )
+
+    async def parse_fast(self, task: Task, r: redis.Redis, sink: Optional[ResultSink] = None) -> ParseResult:
         start = time.time()
         products = []
 
-        city = task.city.strip().lower() or "москва"
-        session, current_proxy = await self._get_session_for_city(task.city, r)
-
-        heavy_df = None
-        if os.path.exists(self.HEAVY_CSV_PATH):
-            try:
-                heavy_df = pd.read_csv(self.HEAVY_CSV_PATH, sep=";", dtype=str, keep_default_na=False)
-                heavy_df["product_id"] = heavy_df["product_id"].str.strip()
-                logger.info("Vkusvill fast | кэш загружен: %d товаров", len(heavy_df))
-            except Exception as e:
-                logger.error("Ошибка чтения heavy CSV: %s", e)
+        session, proxy_lease, session_key = await self._get_session_for_city(task.city, r)
 
+        heavy_index = None
         try:
-            params = {
-                'screen': 'CatalogMain',
-                'number': '&_5>527',
-                'offline': '0',
-                'all_products': 'false',
-                'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[CatalogFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-10]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[56]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6098]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1728539006506]}{[method]}{[/api/bff/get_screen_widgets]}',
-            }
-
-            resp = await session.get(f"{self.BASE_URL}/bff/get_screen_widgets", params=params, headers=self.HEADERS)
-            logger.error(f"widgets {resp}")
-            widgets = resp.json().get("widgets", [])
-
-            tasks = []
-            
-            for widget in widgets:
-                content_items = widget.get("content", [])
-                
-                if not content_items or not isinstance(content_items, list):
-                    continue
-
-                for item in content_items:
-                    title = item.get("title", "").lower()
-                    
-                    if "готовая еда" in title:
-                        cat_id = item.get("object_id")
-                        if not cat_id:
-                            continue
-                        
-                        logger.info(f"Найдена категория: {title} (ID: {cat_id})")
-                        tasks.append(self._fetch_category_fast(session, str(cat_id), title, heavy_df, products))
-            
-            if not tasks:
-                 logger.warning("Не найдена категория 'Готовая еда' в виджетах")
+            heavy_index = await heavy_cache.get(self.HEAVY_CSV_PATH, "product_id")
+            if heavy_index is not None:
+                logger.info("Vkusvill fast | кэш: %d товаров | %s", len(heavy_index), heavy_cache.stats())
+        except Exception as e:
+            logger.error("Ошибка чтения heavy CSV: %s", e)
 
+        try:
+            tasks = [
+                self._fetch_category_fast(session, cat_id, title, heavy_index, products, r, sink)
+                for cat_id, title in await self._get_ready_food_categories(session)
+            ]
             if tasks:
                 await asyncio.gather(*tasks, return_exceptions=True)
 
         except Exception as e:
             logger.error("Vkusvill fast fatal error: %s", e, exc_info=True)
         finally:
-            if current_proxy:
-                await self._checkin_proxy(r, current_proxy)
+            await self._release_session(session, session_key, proxy_lease)
 
         took = round(time.time() - start, 1)
-        logger.info("Vkusvill fast завершён | товаров: %d | время: %.1fс | кэш: %s", len(products), took, "ДА" if heavy_df is not None else "НЕТ")
+        logger.info("Vkusvill fast завершён | товаров: %d | время: %.1fс | кэш: %s", len(products), took, "ДА" if heavy_index is not None else "НЕТ")
 
         return ParseResult(
             task_id=task.task_id,
@@ -224,94 +418,26 @@ class VkusvillParser(BaseParser):
             chat_id=task.chat_id
         )
 
-    async def _fetch_category_fast(self, session, cat_id: str, category: str, heavy_df, result_list: list):
-        limit = 24
-        page = 1
-        
-        while True:
-            offset = (page - 1) * limit
-            
-            params = [
-                ('all_products', 'true'),
-                ('data_source', 'Category'),
-                ('object_id', str(cat_id)),
-                ('number', '&_5>527'),
-                ('sort_id', '7'),
-                ('offset', str(offset)),
-                ('limit', str(limit)),
-                ('offline', '0'),
-                ('all_products', 'false'),
-                ('str_par', '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[CatalogMainFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-18]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[4]}{[def_Number_button]}{[1]}{[def_ShopNo]}{[3700]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1729253880342]}{[method]}{[/api/bff/get_widget_content]}'),
-            ]
-
-            try:
-                resp = await session.get(
-                    f"{self.BASE_URL}/bff/get_widget_content",
-                    params=params,
-                    headers=self.HEADERS
-                )
-                logger.error(f"page_resp fast {resp} {offset} {limit} {cat_id}")
-                
-                data = resp.json()
-
-                if not data:
-                    break
-            
-
+    async def _fetch_category_fast(self, session, cat_id: str, category: str, heavy_index, result_list: list, redis_client: redis.Redis, sink: Optional[ResultSink] = None):
+        try:
+            async for data in self._widget_pages(session, cat_id):
+                try:
+                    cached = await catalog_cache.get_many(redis_client, "vkusvill", [str(item["id"]) for item in data])
+                except Exception as e:
+                    logger.warning("Vkusvill fast | каталог в Redis недоступен: %s", e)
+                    cached = {}
+
+                page = []
                 for item in data:
                     pid = str(item["id"])
-                    name = item.get("title", "Без названия")
-                    
-                    price_obj = item.get("price", {})
-                    current_price_cents = price_obj.get("discount_price") or price_obj.get("price", 0)
-                    base_price_cents = price_obj.get("price", 0)
-                    price = current_price_cents
-                    old_price = base_price_cents if base_price_cents > current_price_cents else None
-                    weight = item.get("weight_str")
-                    amount = item.get("amount", 0) or item.get("amount_express", 0) 
-                    in_stock = bool(amount > 0)
-
-                    photos = []
-                    images_list = item.get("images", [])
-                    large_images_obj = next((img_obj for img_obj in images_list if img_obj.get("type") == "Large"), None)
-                    if large_images_obj:
-                        photos = [img.get("url", "") for img in large_images_obj.get("images", []) if img.get("url")]
-
-                    calories = proteins = fats = carbs = ingredients = None
-                    if heavy_df is not None:
-                        match = heavy_df[heavy_df["product_id"] == pid]
-                        if not match.empty:
-                            r = match.iloc[0]
-                            calories = r.get("calories")
-                            proteins = r.get("proteins")
-                            fats = r.get("fats")
-                            carbs = r.get("carbs")
-                            ingredients = r.get("ingredients")
-                            name = r.get("name", name)
-                            photos = r.get("photos", "").split(" | ") if pd.notna(r.get("photos")) else photos
-
-                    result_list.append(ProductDetail(
-                        product_id=pid,
-                        name=name,
-                        price=price,
-                        old_price=old_price,
-                        calories=calories,
-                        proteins=proteins,
-                        fats=fats,
-                        carbs=carbs,
-                        weight=weight,
-                        ingredients=ingredients,
-                        photos=photos,
-                        category=category,
-                        store="ВкусВилл",
-                        in_stock=in_stock
-                    ))
-
-                page += 1
+                    record = cached.get(pid)
+                    if record is None and heavy_index is not None:
+                        record = heavy_index.get(pid)
+                    page.append(self._product_from_listing(item, category, record))
+                await self.emit(sink, page, result_list)
 
-            except Exception as e:
-                logger.warning(f"Ошибка страницы {page} (offset {offset}) категории {category}: {e}")
-                break
+        except Exception as e:
+            logger.warning(f"Ошибка страницы категории {category}: {e}")
     
     def _parse_nutrient_value(self, match) -> Optional[float]:
         if not match:
@@ -328,158 +454,151 @@ class VkusvillParser(BaseParser):
         except ValueError:
             return None
 
-    async def parse_heavy(self, task: Task, r: redis.Redis) -> ParseResult:
+    async def _fetch_card(self, session: AsyncSession, pid: str, title: str, stats: RequestStats = None) -> Optional[ProductDetail]:
+        async def attempt(hedged: bool):
+            if not hedged:
+                return await self._request_card(session, pid)
+            # Дубль идёт той же дорогой (тот же прокси), но по отдельному соединению
+            proxy = (getattr(session, "proxies", None) or {}).get("https")
+            hedge_key = self._pool_key("hedge", proxy)
+            hedge_session = await self.session_pool.acquire(hedge_key, lambda: self._new_session(proxy))
+            try:
+                return await self._request_card(hedge_session, pid)
+            finally:
+                await self._release_pooled(hedge_key, hedge_session)
+
+        pr = await self.card_policy.call(attempt, stats, gate=lambda hedged: self._admit(session, self.CARD_URL))
+        if pr is None:
+            return None
+        return self._card_from_json(pr, pid, title)
+
+    @contextlib.asynccontextmanager
+    async def _admit(self, session: AsyncSession, url: str):
+        # Hedge идёт через тот же прокси, поэтому и токен берётся из того же ведра
+        await rate_limiter.acquire(url, (getattr(session, "proxies", None) or {}).get("https"))
+        yield
+
+    async def _request_card(self, session: AsyncSession, pid: str) -> Optional[dict]:
+        params = {
+            'number': '&_5>527',
+            'source': '2',
+            'version': '311006',
+            'product_id': pid,
+            'shopno': '0',
+            'offline': '0',
+            'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[ProductFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-10]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[56]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6098]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1728539918115]}{[method]}{[/api/catalog4/product]}',
+        }
+        card_resp = await self._get(
+            session,
+            self.CARD_URL,
+            admitted=True,
+            params=params,
+            headers=self.HEADERS,
+            timeout=15
+        )
+        if card_resp.status in RETRYABLE_STATUSES:
+            raise RetryableStatus(card_resp.status)
+        if card_resp.status != 200:
+            logger.warning(f"Карточка {pid} вернула {card_resp.status}")
+            return None
+        return card_resp.json()
+
+    def _card_from_json(self, pr: dict, pid: str, title: str) -> ProductDetail:
+
+        calories = proteins = fats = carbs = None
+        for prop in pr.get("properties", []):
+            if prop.get("property_name") == "Пищевая и энергетическая ценность в 100 г":
+                text = prop.get("property_value", "")
+                proteins = self._parse_nutrient_value(re.search(r"белки?\s*([\d.,]+)", text, re.I))
+                fats     = self._parse_nutrient_value(re.search(r"жиры?\s*([\d.,]+)", text, re.I))
+                carbs    = self._parse_nutrient_value(re.search(r"углеводы?\s*([\d.,]+)", text, re.I))
+                calories = self._parse_nutrient_value(re.search(r"(\d+)\s*ккал", text, re.I))
+                break
+
+        ingredients = next(
+            (p["property_value"] for p in pr.get("properties", []) if p.get("property_name") == "Состав"),
+            None
+        )
+
+        photos = []
+        for block in pr.get("images", []):
+            if block.get("type") == "Large":
+                for img in block.get("images", []):
+                    if url := img.get("url"):
+                        photos.append(url)
+                break
+
+        weight = pr.get("weight_str") or f"{pr.get('weight_kg', 0) * 1000:.0f} г"
+        amount = pr.get("amount", 0) or pr.get("amount_express", 0)
+        in_stock = bool(amount > 0)
+
+        return ProductDetail(
+            product_id=pid,
+            name=pr.get("title", ""),
+            price=pr.get("price", {}).get("price", 0) ,
+            old_price=pr.get("price", {}).get("discount_price", 0)
+                    if pr.get("price", {}).get("discount_percent", 0) > 0 else None,
+            calories=calories,
+            proteins=proteins,
+            fats=fats,
+            carbs=carbs,
+            weight=weight,
+            ingredients=ingredients,
+            photos=photos[:10],
+            category=title,
+            store="ВкусВилл",
+            in_stock=in_stock
+        )
+
+    async def parse_heavy(self, task: Task, r: redis.Redis, sink: Optional[ResultSink] = None) -> ParseResult:
         start = time.time()
         detailed = []
         session = None
-        current_proxy = None
+        proxy_lease = None
 
-        session, current_proxy = await self._get_session_for_city(task.city, r)
+        session, proxy_lease, session_key = await self._get_session_for_city(task.city, r)
+        cards = BoundedTaskPool(settings.VKUSVILL_HEAVY_CONCURRENCY)
+        card_stats = RequestStats()
+        pids = []
+        fingerprints = {}
+        cards_start = time.time()
+        listing_complete = False
 
         try:
-            params = {
-                'screen': 'CatalogMain',
-                'number': '&_5>527',
-                'offline': '0',
-                'all_products': 'false',
-                'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[CatalogFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-10]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[56]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6098]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1728539006506]}{[method]}{[/api/bff/get_screen_widgets]}',
-            }
-            resp = await session.get(f"{self.BASE_URL}/bff/get_screen_widgets", params=params, headers=self.HEADERS)
-            widgets = resp.json().get("widgets", [])
-            
-            categories_to_parse = []
-            for widget in widgets:
-                content_items = widget.get("content", [])
-                if not content_items or not isinstance(content_items, list):
-                    continue
-                
-                for item in content_items:
-                    title = item.get("title", "").lower()
-                    if title and "готовая еда" in title:
-                        cat_id = item.get("object_id")
-                        if cat_id:
-                            categories_to_parse.append((str(cat_id), title))
-
-            if not categories_to_parse:
-                logger.warning("Не найдена категория 'Готовая еда' для heavy парсинга.")
-            logger.warning(categories_to_parse)
-            for cat_id, title in categories_to_parse:
-                limit = 24
-                page = 1
-                while True:
-                    offset = (page - 1) * limit
-                    
-                    params = [
-                        ('all_products', 'true'),
-                        ('data_source', 'Category'),
-                        ('object_id', str(cat_id)),
-                        ('number', '&_5>527'),
-                        ('sort_id', '7'),
-                        ('offset', str(offset)),
-                        ('limit', str(limit)),
-                        ('offline', '0'),
-                        ('all_products', 'false'),
-                        ('str_par', '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[CatalogMainFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-18]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[4]}{[def_Number_button]}{[1]}{[def_ShopNo]}{[3700]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1729253880342]}{[method]}{[/api/bff/get_widget_content]}'),
-                    ]
-
-                    page_resp = await session.get(
-                        f"{self.BASE_URL}/bff/get_widget_content",
-                        params=params,
-                        headers=self.HEADERS
-                    )
-                    logger.error(f"page_resp {page_resp} {offset}")
-                    
-                    data = page_resp.json()
-                    
-                    if not data:
-                        break
-
+            for cat_id, title in await self._get_ready_food_categories(session):
+                async for data in self._widget_pages(session, cat_id):
                     for item in data:
                         if item.get("type") and item.get("type") != "product":
                             continue
 
                         pid = str(item["id"])
-                        try:
-                            params = {
-                                'number': '&_5>527',
-                                'source': '2',
-                                'version': '311006',
-                                'product_id': pid,
-                                'shopno': '0',
-                                'offline': '0',
-                                'str_par': '{[version]}{[311006]}{[device_model]}{[V2339A]}{[screen_id]}{[ProductFragment]}{[source]}{[2]}{[device_id]}{[15bad36a-71b8-46d9-9c3a-8aaed80bca46]}{[def_Date_service]}{[2024-10-10]}{[def_id_service]}{[32]}{[def_type_service]}{[1]}{[def_gettype]}{[56]}{[def_Number_button]}{[null]}{[def_ShopNo]}{[6098]}{[def_slot_during]}{[01:00:00]}{[def_slot_since]}{[null]}{[def_slot_until]}{[null]}{[user_number]}{[&_5>527]}{[ts]}{[1728539918115]}{[method]}{[/api/catalog4/product]}',
-                                }
-                            card_resp = await session.get(
-                                f"{self.BASE_URL}/catalog4/product",
-                                params=params, 
-                                headers=self.HEADERS,
-                                timeout=15
-                            )
-                            if card_resp.status != 200:
-                                logger.warning(f"Карточка {pid} вернула {card_resp.status}")
-                                continue
-
-                            pr = card_resp.json() 
-
-                            calories = proteins = fats = carbs = None
-                            for prop in pr.get("properties", []):
-                                if prop.get("property_name") == "Пищевая и энергетическая ценность в 100 г":
-                                    text = prop.get("property_value", "")
-                                    proteins = self._parse_nutrient_value(re.search(r"белки?\s*([\d.,]+)", text, re.I))
-                                    fats     = self._parse_nutrient_value(re.search(r"жиры?\s*([\d.,]+)", text, re.I))
-                                    carbs    = self._parse_nutrient_value(re.search(r"углеводы?\s*([\d.,]+)", text, re.I))
-                                    calories = self._parse_nutrient_value(re.search(r"(\d+)\s*ккал", text, re.I))
-                                    break
-
-                            ingredients = next(
-                                (p["property_value"] for p in pr.get("properties", []) if p.get("property_name") == "Состав"),
-                                None
-                            )
-
-                            photos = []
-                            for block in pr.get("images", []):
-                                if block.get("type") == "Large":
-                                    for img in block.get("images", []):
-                                        if url := img.get("url"):
-                                            photos.append(url)
-                                    break  
-
-                            weight = pr.get("weight_str") or f"{pr.get('weight_kg', 0) * 1000:.0f} г"
-                            amount = pr.get("amount", 0) or pr.get("amount_express", 0)
-                            in_stock = bool(amount > 0)
-
-                            detailed.append(ProductDetail(
-                                product_id=pid,
-                                name=pr.get("title", ""),
-                                price=pr.get("price", {}).get("price", 0) ,  
-                                old_price=pr.get("price", {}).get("discount_price", 0) 
-                                        if pr.get("price", {}).get("discount_percent", 0) > 0 else None,
-                                calories=calories,
-                                proteins=proteins,
-                                fats=fats,
-                                carbs=carbs,
-                                weight=weight,
-                                ingredients=ingredients,
-                                photos=photos[:10], 
-                                category=title,
-                                store="ВкусВилл",
-                                in_stock=in_stock
-                            ))
-
-
-                        except Exception as e:
-                            logger.warning(f"Ошибка парсинга карточки {pid}: {e}")
-
-                    page += 1
+                        pids.append(pid)
+                        fingerprints[pid] = self._listing_fingerprint(item)
+                        cards.submit(self._fetch_card(session, pid, title, card_stats))
+            listing_complete = True
 
         except Exception as e:
             logger.error("Vkusvill heavy fatal error: %s", e, exc_info=True)
         finally:
-            if current_proxy:
-                await self._checkin_proxy(r, current_proxy)
+            detailed = [card for _, card in await self._collect_cards(cards, pids, sink)]
+            cards_took = time.time() - cards_start
+            logger.info(
+                "Vkusvill heavy карточки | %d/%d | %.1fс | %.1f карт/с | параллельно: %d | запросы: %s | лимиты: %s",
+                len(detailed), len(pids), cards_took,
+                len(detailed) / cards_took if cards_took > 0 else 0.0,
+                settings.VKUSVILL_HEAVY_CONCURRENCY, card_stats.as_dict(), rate_limiter.stats()
+            )
+            await self._release_session(session, session_key, proxy_lease)
 
         if detailed:
-            df = pd.DataFrame([{
+            try:
+                await catalog_cache.put_many(r, "vkusvill", {
+                    p.product_id: product_to_record(p, fingerprints.get(p.product_id)) for p in detailed
+                })
+            except Exception as e:
+                logger.error("Vkusvill heavy | ошибка записи каталога в Redis: %s", e)
+
+            rows = [{
                 "product_id": p.product_id,
                 "name": p.name,
                 "price": p.price,
@@ -492,18 +611,52 @@ class VkusvillParser(BaseParser):
                 "ingredients": p.ingredients,
                 "photos": " | ".join(p.photos[:5]),
                 "category": p.category
-            } for p in detailed])
+            } for p in detailed]
 
-            os.makedirs(settings.DATA_DIR, exist_ok=True)
-            df.to_csv(self.HEAVY_CSV_PATH, sep=";", index=False, encoding="utf-8-sig")
-            logger.info("Vkusvill HEAVY кэш сохранён: %d товаров", len(df))
+            if listing_complete:
+                saved = await run_blocking(save_heavy_csv, self.HEAVY_CSV_PATH, rows)
+                logger.info("Vkusvill HEAVY кэш сохранён: %d товаров", saved)
+            else:
+                # Без полного листинга кэш прошлого прогона полнее текущего — оставляем его
+                logger.warning("Vkusvill heavy | листинг неполный, heavy кэш %s не перезаписан", self.HEAVY_CSV_PATH)
 
         return ParseResult(
             task_id=task.task_id,
             service="vkusvill",
             mode="heavy",
-            products=detailed,
+            products=detailed if sink is None else [],
             took_seconds=round(time.time() - start, 1),
             user_id=task.user_id,
-            chat_id=task.chat_id
-        )
\ No newline at end of file
+            chat_id=task.chat_id,
+            stats=card_stats.as_dict()
+        )
+
+    async def _open_incremental(self, task: Task, r: redis.Redis) -> tuple:
+        return await self._get_session_for_city(task.city, r)
+
+    async def _close_incremental(self, scope: tuple) -> None:
+        session, proxy_lease, session_key = scope
+        await self._release_session(session, session_key, proxy_lease)
+
+    async def _incremental_pages(self, scope: tuple, r: redis.Redis):
+        session = scope[0]
+        for cat_id, title in await self._get_ready_food_categories(session):
+            async for data in self._widget_pages(session, cat_id):
+                yield [
+                    (str(item["id"]), item, title)
+                    for item in data if not item.get("type") or item.get("type") == "product"
+                ]
+
+    def _incremental_card(self, scope: tuple, item: dict, category: str, stats: RequestStats):
+        return self._fetch_card(scope[0], str(item["id"]), category, stats)
+
+    def _listing_product(self, scope: tuple, item: dict, category: str, record: Optional[dict]) -> ProductDetail:
+        return self._product_from_listing(item, category, record)
+
+    def _card_record(self, p: ProductDetail, fingerprint: Optional[str]) -> dict:
+        return product_to_record(p, fingerprint)
+
+    async def close(self) -> None:
+        await super().close()
+        await self.session_pool.close_all()
+        await self.proxy_manager.close()
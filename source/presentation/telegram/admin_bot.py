@@ -1,50 +1,338 @@
 import asyncio
+import os
+import tempfile
+import time
 import uuid
 import logging
+
+from source.utils import startup
+startup.install()
+
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
-from aiogram.types import Message, BufferedInputFile
+from aiogram.types import Message, BufferedInputFile, FSInputFile
 from source.core.dto import Task, ParseResult
 from source.core.config import settings
-from source.utils.csv_exporter import result_to_csv_bytes
+from source.utils.csv_exporter import FORMATS, result_to_bytes, result_to_csv_bytes
+from source.infra import claim_check
+from source.utils.concurrency import KeyedSemaphore
+from source.utils.loop_monitor import LoopMonitor
+from source.utils.lru import LRUCache
+from source.utils.offload import run_blocking, shutdown as shutdown_offload
+from source.utils.wire import decode_result, encode_task
 import redis.asyncio as redis
 import re
+from collections import deque
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-bot = Bot(token=settings.TG_BOT_TOKEN)
 dp = Dispatcher()
+_bot: Bot | None = None
 
 VKUSVILL_ALLOWED_CITIES = {"москва", "санкт-петербург", "спб", "питер", "новосибирск", "екатеринбург", "казань"}
 
+STREAM_PROGRESS_INTERVAL = 5.0
+TELEGRAM_RETRIES = 3
+
+
+class StreamProgress:
+    """Сборка потокового результата: части дописываются во временный CSV на диске."""
+
+    def __init__(self, run: str):
+        self.run = run
+        self.seq = 0
+        self.count = 0
+        self.file = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+        self.message: Message | None = None
+        self.last_edit = 0.0
+
+    def discard(self):
+        self.file.close()
+        os.unlink(self.file.name)
+
+
+class StreamGap(Exception):
+    """Часть потока пришла раньше предыдущей: запись остаётся в pending до своей очереди."""
+
+
+def append_chunk(file, result: ParseResult, header: bool) -> None:
+    file.write(result_to_csv_bytes(result, header=header))
+
+
+streams: dict[str, StreamProgress] = {}
+finished_runs: deque = deque(maxlen=1000)
+
+redis_client: redis.Redis | None = None
+delivered = LRUCache(max_size=settings.BOT_DEDUP_WINDOW)
+stream_lanes = KeyedSemaphore(1)
+chat_slots = KeyedSemaphore(settings.BOT_CHAT_CONCURRENCY)
+send_slots = asyncio.Semaphore(settings.BOT_SEND_CONCURRENCY)
+flood_until = 0.0
+
+
+def get_bot() -> Bot:
+    # Bot (и его HTTP-сессия) создаётся при первом обращении, а не при импорте модуля
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=settings.TG_BOT_TOKEN)
+    return _bot
+
+
+def get_redis() -> redis.Redis:
+    # Один клиент (и пул соединений) на весь процесс бота
+    global redis_client
+    if redis_client is None:
+        redis_client = redis.from_url(settings.REDIS_URL)
+    return redis_client
+
+
+async def telegram_call(method, *args, **kwargs):
+    """Вызов Bot API с учётом flood control: RetryAfter приостанавливает все отправки бота."""
+    global flood_until
+    for attempt in range(TELEGRAM_RETRIES + 1):
+        delay = flood_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            return await method(*args, **kwargs)
+        except TelegramRetryAfter as e:
+            if attempt == TELEGRAM_RETRIES:
+                raise
+            flood_until = max(flood_until, time.monotonic() + e.retry_after)
+            logger.warning(f"Flood control Telegram: пауза {e.retry_after}с")
+
+
+async def report_progress(state: StreamProgress, result: ParseResult, force: bool = False):
+    text = f"{result.service.upper()} • {result.mode} | получено {state.count} товаров…"
+    try:
+        if state.message is None:
+            state.message = await telegram_call(get_bot().send_message, chat_id=result.chat_id, text=text)
+        elif force or time.monotonic() - state.last_edit >= STREAM_PROGRESS_INTERVAL:
+            await telegram_call(get_bot().edit_message_text, text, chat_id=result.chat_id, message_id=state.message.message_id)
+        else:
+            return
+        state.last_edit = time.monotonic()
+    except Exception as e:
+        logger.warning(f"Не удалось обновить прогресс {result.task_id}: {e}")
+
+
+async def handle_stream_entry(data: dict, result: ParseResult):
+    kind = data[b"kind"].decode()
+    run = data[b"run"].decode()
+    seq = int(data[b"seq"])
+    if run in finished_runs:
+        return
+
+    state = streams.get(result.task_id)
+    if state is None or state.run != run:
+        # Новая попытка той же задачи вытесняет куски прерванной
+        if state is not None:
+            state.discard()
+        state = streams[result.task_id] = StreamProgress(run)
+
+    if seq <= state.seq:
+        return
+    if seq != state.seq + 1 and kind != "aborted":
+        # Пропущенная часть ещё в pending и придёт повтором; без неё CSV был бы неполным
+        raise StreamGap(f"ждём часть {state.seq + 1}, пришла {seq}")
+
+    if kind == "chunk":
+        await run_blocking(append_chunk, state.file, result, state.count == 0)
+        state.seq = seq
+        state.count += len(result.products)
+        await report_progress(state, result)
+        return
+
+    if kind == "aborted":
+        finish_stream(result.task_id, state)
+        logger.warning(f"Поток {result.task_id} прерван, ждём повтор задачи")
+        if state.message is not None:
+            try:
+                await telegram_call(
+                    get_bot().edit_message_text,
+                    f"{result.service.upper()} • {result.mode} | сбой после {state.count} товаров, задача будет повторена",
+                    chat_id=result.chat_id, message_id=state.message.message_id
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось обновить прогресс {result.task_id}: {e}")
+        return
+
+    # Итог: поток закрывается только после успешной отправки. Если send_document
+    # упадёт, запись останется в pending и при повторе файл будет отправлен заново
+    if state.count:
+        await run_blocking(state.file.flush)
+        await report_progress(state, result, force=True)
+        await telegram_call(
+            get_bot().send_document,
+            chat_id=result.chat_id,
+            document=FSInputFile(state.file.name, filename=f"{result.service}_{result.mode}_{result.task_id}.csv"),
+            caption=f"Готово за {result.took_seconds:.1f}с | {result.service.upper()} • {result.mode} | {state.count} товаров"
+        )
+    finish_stream(result.task_id, state)
+
+
+def finish_stream(task_id: str, state: StreamProgress):
+    streams.pop(task_id, None)
+    finished_runs.append(state.run)
+    state.discard()
+
+
+async def abandon_stream(data: dict):
+    # Часть потока отброшена после MAX_DELIVERIES: неполный файл не отправляем
+    task_id, run = data[b"task_id"].decode(), data[b"run"].decode()
+    state = streams.get(task_id)
+    if state is None or state.run != run:
+        finished_runs.append(run)
+        return
+    finish_stream(task_id, state)
+    if state.message is not None:
+        try:
+            await telegram_call(
+                get_bot().edit_message_text,
+                f"Результат {task_id} неполный: часть не доставлена, файл не отправлен",
+                chat_id=state.message.chat.id, message_id=state.message.message_id
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс {task_id}: {e}")
+
+async def acknowledge(r: redis.Redis, msg_id: bytes, data: dict):
+    await claim_check.discard(r, data)
+    await r.xack(settings.OUTPUT_STREAM, settings.BOT_CONSUMER_GROUP, msg_id)
+    await r.xdel(settings.OUTPUT_STREAM, msg_id)
+    delivered.set(msg_id, True)
+
+
+async def send_result(r: redis.Redis, data: dict, result: ParseResult | None):
+    if result is None:
+        result = await claim_check.unpack(r, data)
+    if not result.products:
+        return
+    document = BufferedInputFile(
+        await run_blocking(result_to_bytes, result, settings.EXPORT_FORMAT),
+        filename=f"{result.service}_{result.mode}_{result.task_id}{FORMATS[settings.EXPORT_FORMAT]}"
+    )
+    await telegram_call(
+        get_bot().send_document,
+        chat_id=result.chat_id,
+        document=document,
+        caption=f"Готово за {result.took_seconds:.1f}с | {result.service.upper()} • {result.mode} | {len(result.products)} товаров"
+    )
+
+
+async def deliver(r: redis.Redis, msg_id: bytes, data: dict, result: ParseResult | None, chat_id: int, lane):
+    # Части одного потока идут по одной полосе lane строго по порядку чтения
+    try:
+        async with stream_lanes.hold(lane), chat_slots.hold(chat_id), send_slots:
+            if b"kind" in data:
+                await handle_stream_entry(data, result or await claim_check.unpack(r, data))
+            else:
+                await send_result(r, data, result)
+    except StreamGap as e:
+        logger.info(f"Запись {msg_id} отложена: {e}")
+        return
+    except LookupError as e:
+        logger.error(f"Результат {msg_id} потерян: {e}")
+    except Exception as e:
+        # Без ack запись останется в pending и будет подхвачена повторно
+        logger.error(f"Не удалось доставить {msg_id}: {e}")
+        return
+    await acknowledge(r, msg_id, data)
+
+
+async def dispatch(r: redis.Redis, msg_id: bytes, data: dict, slots: asyncio.Semaphore, in_flight: dict):
+    if msg_id in in_flight:
+        return
+    if not data or msg_id in delivered:
+        await acknowledge(r, msg_id, data or {})
+        return
+
+    try:
+        summary = claim_check.summary(data)
+        if summary is not None:
+            # Большой результат по ссылке: тело заберём только при отправке
+            result, chat_id = None, summary["chat_id"]
+            if not summary["products"] and b"kind" not in data:
+                await acknowledge(r, msg_id, data)
+                return
+        else:
+            # Inline-запись до порога claim-check — это тысячи товаров, валидация не для цикла
+            result = await run_blocking(decode_result, data)
+            chat_id = result.chat_id
+    except Exception as e:
+        logger.error(f"Не удалось разобрать результат {msg_id}, запись отброшена: {e}")
+        await acknowledge(r, msg_id, data)
+        return
+
+    lane = data[b"task_id"] if b"kind" in data else msg_id
+    await slots.acquire()
+    job = asyncio.create_task(deliver(r, msg_id, data, result, chat_id, lane))
+    in_flight[msg_id] = job
+
+    def _done(_):
+        in_flight.pop(msg_id, None)
+        slots.release()
+
+    job.add_done_callback(_done)
+
+
+async def ensure_results_group(r: redis.Redis):
+    # id="0": записи, накопившиеся до появления группы, тоже будут доставлены
+    try:
+        await r.xgroup_create(settings.OUTPUT_STREAM, settings.BOT_CONSUMER_GROUP, id="0", mkstream=True)
+        logger.info(f"Создана группа {settings.BOT_CONSUMER_GROUP} для потока {settings.OUTPUT_STREAM}")
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def reclaim_results(r: redis.Redis, slots: asyncio.Semaphore, in_flight: dict):
+    # Недоставленные записи (сбой отправки, рестарт бота) остаются в pending группы
+    start_id = "0-0"
+    while True:
+        resp = await r.xautoclaim(
+            settings.OUTPUT_STREAM, settings.BOT_CONSUMER_GROUP, settings.BOT_CONSUMER_NAME,
+            min_idle_time=settings.BOT_RECLAIM_IDLE_MS, start_id=start_id, count=10
+        )
+        next_id, messages = resp[0], resp[1]
+        for msg_id, data in messages:
+            if msg_id in in_flight:
+                continue
+            pending = await r.xpending_range(
+                settings.OUTPUT_STREAM, settings.BOT_CONSUMER_GROUP, min=msg_id, max=msg_id, count=1
+            )
+            deliveries = pending[0]["times_delivered"] if pending else 0
+            if deliveries > settings.MAX_DELIVERIES:
+                logger.error(f"Результат {msg_id} не доставлен за {deliveries} попыток, запись отброшена")
+                if data and b"kind" in data:
+                    await abandon_stream(data)
+                await acknowledge(r, msg_id, data or {})
+                continue
+            await dispatch(r, msg_id, data, slots, in_flight)
+        if next_id in (b"0-0", "0-0"):
+            break
+        start_id = next_id
+
+
 async def results_listener():
-    r = redis.from_url(settings.REDIS_URL)
-    processed = set()
+    r = get_redis()
+    await ensure_results_group(r)
+    slots = asyncio.Semaphore(settings.BOT_MAX_IN_FLIGHT)
+    in_flight: dict = {}
+    reclaim_at = 0.0
     while True:
         try:
-            msgs = await r.xread({settings.OUTPUT_STREAM: "0"}, count=10, block=5000)
-            for _, messages in msgs:
+            if time.monotonic() >= reclaim_at:
+                reclaim_at = time.monotonic() + settings.BOT_RECLAIM_INTERVAL
+                await reclaim_results(r, slots, in_flight)
+
+            msgs = await r.xreadgroup(
+                settings.BOT_CONSUMER_GROUP, settings.BOT_CONSUMER_NAME,
+                {settings.OUTPUT_STREAM: ">"}, count=10, block=5000
+            )
+            for _, messages in msgs or []:
                 for msg_id, data in messages:
-                    if msg_id in processed:
-                        await r.xdel(settings.OUTPUT_STREAM, msg_id)
-                        continue
-                    result = ParseResult.model_validate_json(data[b"data"].decode())
-                    if not result.products:
-                        processed.add(msg_id)
-                        await r.xdel(settings.OUTPUT_STREAM, msg_id)
-                        continue
-
-                    document = BufferedInputFile(
-                        result_to_csv_bytes(result),
-                        filename=f"{result.service}_{result.mode}_{result.task_id}.csv"
-                    )
-                    await bot.send_document(
-                        chat_id=result.chat_id,
-                        document=document,
-                        caption=f"Готово за {result.took_seconds:.1f}с | {result.service.upper()} • {result.mode} | {len(result.products)} товаров"
-                    )
-                    processed.add(msg_id)
-                    await r.xdel(settings.OUTPUT_STREAM, msg_id)
+                    await dispatch(r, msg_id, data, slots, in_flight)
         except Exception as e:
             logger.error(f"Listener error: {e}")
             await asyncio.sleep(3)
@@ -52,12 +340,15 @@ async def results_listener():
 @dp.message(Command("parse"))
 async def parse_command(message: Message):
     args = message.text.split()
+    stream = "--stream" in args
+    args = [a for a in args if a != "--stream"]
     if len(args) < 4:
         return await message.answer(
             "Примеры:\n"
             "/parse vkusvill fast Москва\n"
             "/parse vkusvill fast 55.75,37.61\n"
-            "/parse kuper fast Саратов Лента"
+            "/parse kuper fast Саратов Лента\n"
+            "/parse vkusvill heavy Москва --stream"
         )
 
     service = args[1].lower()
@@ -65,8 +356,8 @@ async def parse_command(message: Message):
 
     if service not in ["vkusvill", "kuper"]:
         return await message.answer("Сервис: vkusvill или kuper")
-    if mode not in ["fast", "heavy"]:
-        return await message.answer("Режим: fast или heavy")
+    if mode not in ["fast", "heavy", "incremental"]:
+        return await message.answer("Режим: fast, heavy или incremental")
 
     store = None
     if service == "kuper" and len(args) >= 5:
@@ -91,11 +382,11 @@ async def parse_command(message: Message):
         store=store,    
         limit=5000,
         user_id=message.from_user.id,
-        chat_id=message.chat.id
+        chat_id=message.chat.id,
+        stream=stream
     )
 
-    r = redis.from_url(settings.REDIS_URL)
-    await r.xadd(settings.INPUT_STREAM, {"data": task.model_dump_json()})
+    await get_redis().xadd(settings.INPUT_STREAM, encode_task(task))
 
     store_text = f" | Магазин: {store.title()}" if store else ""
     location_text = city_input
@@ -116,17 +407,31 @@ async def cmd_start(message: Message):
         "Команда:\n"
         "/parse vkusvill fast Москва\n"
         "/parse vkusvill heavy Москва\n"
+        "/parse vkusvill incremental Москва\n"
         "/parse kuper fast Саратов Ашан\n"
-        "/parse kuper heavy Казань Перекрёсток\n\n"
+        "/parse kuper heavy Казань Перекрёсток\n"
+        "/parse vkusvill heavy Москва --stream — прогресс по ходу парсинга\n\n"
         "Для Купера — любой город России!"
     )
 
 async def main():
     logger.info("Bot started")
-    await asyncio.gather(
-        dp.start_polling(bot),
-        results_listener()
-    )
+    startup.report(settings.STARTUP_REPORT_TOP)
+    monitor = None
+    if settings.LOOP_MONITOR_THRESHOLD > 0:
+        monitor = LoopMonitor(settings.LOOP_MONITOR_THRESHOLD)
+        monitor.start()
+    try:
+        await asyncio.gather(
+            dp.start_polling(get_bot()),
+            results_listener()
+        )
+    finally:
+        if redis_client is not None:
+            await redis_client.aclose()
+        if monitor is not None:
+            monitor.stop()
+        shutdown_offload()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
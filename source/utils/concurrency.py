@@ -0,0 +1,61 @@
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Awaitable, Dict, Hashable, List, Tuple
+
+
+class BoundedTaskPool:
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(max(1, limit))
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def _run(self, coro: Awaitable[Any]) -> Any:
+        async with self._semaphore:
+            return await coro
+
+    def submit(self, coro: Awaitable[Any]) -> None:
+        self._tasks.append(asyncio.create_task(self._run(coro)))
+
+    async def as_completed(self) -> AsyncIterator[Tuple[int, Any]]:
+        # (индекс submit, результат или исключение) по мере готовности; пул отпускает задачи
+        index = {t: i for i, t in enumerate(self._tasks)}
+        pending = set(self._tasks)
+        self._tasks = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.cancelled():
+                        yield index.pop(t), asyncio.CancelledError()
+                    else:
+                        yield index.pop(t), t.exception() or t.result()
+        finally:
+            for t in pending:
+                t.cancel()
+
+
+class KeyedSemaphore:
+    """Отдельный семафор на каждый ключ; запись удаляется, когда её никто не держит и не ждёт."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._items: Dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        item = self._items.get(key)
+        if item is None:
+            item = self._items[key] = [asyncio.Semaphore(self.limit), 0]
+        item[1] += 1
+        try:
+            async with item[0]:
+                yield
+        finally:
+            item[1] -= 1
+            if not item[1]:
+                self._items.pop(key, None)
@@ -1,7 +1,23 @@
-import pandas as pd
+import csv
+import gzip
 import io
+import tempfile
+from typing import BinaryIO, Callable, Iterable, List
+
 from source.core.dto import ParseResult
 
+COLUMNS = [
+    "product_id", "name", "store", "category",
+    "price", "old_price", "Наличие",
+    "calories", "proteins", "fats", "carbs",
+    "weight", "ingredients", "photos"
+]
+
+FORMATS = {"csv": ".csv", "csv.gz": ".csv.gz", "xlsx": ".xlsx"}
+
+# Сколько держать в памяти, прежде чем SpooledTemporaryFile уйдёт на диск
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 
 def _force_text(value) -> str:
     if value is None or value == "":
@@ -15,45 +31,90 @@ def _force_text(value) -> str:
     return str_val
 
 
-def result_to_csv_bytes(result: ParseResult) -> bytes:
-    rows = []
-    for p in result.products:
-        in_stock = getattr(p, "in_stock", True)  
-        in_stock_text = "Есть" if in_stock else "Нет"
-
-        rows.append({
-            "product_id": p.product_id,
-            "name": (getattr(p, "name", "") or "").strip(),
-            "price": _force_text(getattr(p, "price", "")),
-            "old_price": _force_text(getattr(p, "old_price", "")) if getattr(p, "old_price", None) else "",
-            "calories": _force_text(getattr(p, "calories", "")) if getattr(p, "calories", None) else "",
-            "proteins": _force_text(getattr(p, "proteins", "")) if getattr(p, "proteins", None) else "",
-            "fats": _force_text(getattr(p, "fats", "")) if getattr(p, "fats", None) else "",
-            "carbs": _force_text(getattr(p, "carbs", "")) if getattr(p, "carbs", None) else "",
-            "weight": getattr(p, "weight", "") or "",
-            "ingredients": str(getattr(p, "ingredients", "") or "").replace("\n", " ").replace("\r", ""),
-            "photos": " | ".join(getattr(p, "photos", [])[:5]) if getattr(p, "photos", None) else "",
-            "category": getattr(p, "category", "") or "",
-            "store": getattr(p, "store", "") or "",
-            "Наличие": in_stock_text,
-        })
-
-    df = pd.DataFrame(rows)
-
-    column_order = [
-        "product_id", "name", "store", "category",
-        "price", "old_price", "Наличие",  
-        "calories", "proteins", "fats", "carbs",
-        "weight", "ingredients", "photos"
+def _plain_text(value) -> str:
+    # В XLSX ячейка и так строковая, апостроф-защита от Excel не нужна
+    if value is None or value == "":
+        return ""
+    return str(value).strip()
+
+
+def _row(p, text: Callable = _force_text) -> List[str]:
+    old_price = getattr(p, "old_price", None)
+    calories = getattr(p, "calories", None)
+    proteins = getattr(p, "proteins", None)
+    fats = getattr(p, "fats", None)
+    carbs = getattr(p, "carbs", None)
+    photos = getattr(p, "photos", None)
+    return [
+        p.product_id,
+        (getattr(p, "name", "") or "").strip(),
+        getattr(p, "store", "") or "",
+        getattr(p, "category", "") or "",
+        text(getattr(p, "price", "")),
+        text(old_price) if old_price else "",
+        "Есть" if getattr(p, "in_stock", True) else "Нет",
+        text(calories) if calories else "",
+        text(proteins) if proteins else "",
+        text(fats) if fats else "",
+        text(carbs) if carbs else "",
+        getattr(p, "weight", "") or "",
+        str(getattr(p, "ingredients", "") or "").replace("\n", " ").replace("\r", ""),
+        " | ".join(photos[:5]) if photos else "",
     ]
-    df = df.reindex(columns=column_order)
-
-    output = io.StringIO()
-    df.to_csv(
-        output,
-        sep=";",
-        index=False,
-        encoding="utf-8-sig",
-        lineterminator="\n"
-    )
-    return output.getvalue().encode("utf-8-sig")
\ No newline at end of file
+
+
+def iter_rows(result: ParseResult, text: Callable = _force_text) -> Iterable[List[str]]:
+    return (_row(p, text) for p in result.products)
+
+
+def write_csv(result: ParseResult, out: BinaryIO, header: bool = True) -> None:
+    """Пишет CSV построчно прямо в бинарный поток: ';', '\\n', BOM только с заголовком."""
+    # BOM только в начале файла: части без заголовка дописываются к первой
+    stream = io.TextIOWrapper(out, encoding="utf-8-sig" if header else "utf-8", newline="", write_through=True)
+    try:
+        writer = csv.writer(stream, delimiter=";", lineterminator="\n")
+        if header:
+            writer.writerow(COLUMNS)
+        writer.writerows(iter_rows(result))
+    finally:
+        stream.detach()
+
+
+def write_xlsx(result: ParseResult, out: BinaryIO) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("products")
+    ws.append(COLUMNS)
+    for row in iter_rows(result, _plain_text):
+        ws.append(row)
+    wb.save(out)
+
+
+def export_result(result: ParseResult, fmt: str = "csv", out: BinaryIO = None) -> BinaryIO:
+    """Выгрузка в fmt (csv, csv.gz, xlsx). По умолчанию — в SpooledTemporaryFile, перемотанный в начало."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+    if fmt == "xlsx":
+        write_xlsx(result, out)
+    elif fmt == "csv.gz":
+        # mtime=0: одинаковые данные дают одинаковый архив
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6, mtime=0) as gz:
+            write_csv(result, gz)
+    else:
+        write_csv(result, out)
+    out.seek(0)
+    return out
+
+
+def result_to_bytes(result: ParseResult, fmt: str = "csv") -> bytes:
+    return export_result(result, fmt, io.BytesIO()).getvalue()
+
+
+def result_to_csv_bytes(result: ParseResult, header: bool = True) -> bytes:
+    out = io.BytesIO()
+    write_csv(result, out, header)
+    return out.getvalue()
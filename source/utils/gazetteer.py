@@ -0,0 +1,34 @@
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+GAZETTEER_PATH = Path(__file__).resolve().parent.parent / "resources" / "gazetteer_ru.tsv"
+
+_PREFIX_RE = re.compile(r"^(г|гор|город)\.?\s+")
+_SEPARATORS_RE = re.compile(r"[\s\-‐–—_.,]+")
+
+
+def normalize_city_name(name: str) -> str:
+    value = name.strip().lower().replace("ё", "е")
+    value = _PREFIX_RE.sub("", value)
+    return _SEPARATORS_RE.sub(" ", value).strip()
+
+
+@lru_cache(maxsize=1)
+def _index() -> Dict[str, tuple[float, float]]:
+    index: Dict[str, tuple[float, float]] = {}
+    with open(GAZETTEER_PATH, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            parts = line.rstrip("\n").split("\t")
+            name, lat, lon = parts[0], float(parts[1]), float(parts[2])
+            aliases = parts[3].split(",") if len(parts) > 3 and parts[3] else []
+            for key in (name, *aliases):
+                index.setdefault(normalize_city_name(key), (lat, lon))
+    return index
+
+
+def lookup_city(name: str) -> Optional[tuple[float, float]]:
+    return _index().get(normalize_city_name(name))
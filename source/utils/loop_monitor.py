@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+logger = logging.getLogger("loop_monitor")
+
+
+class LoopMonitor:
+    """Сторожевой поток для цикла asyncio.
+
+    Корутина в цикле раз в interval обновляет отметку времени. Если отметка
+    не обновлялась дольше threshold, поток пишет в лог стек, на котором стоит
+    цикл, — то есть сам блокирующий шаг, а не только факт задержки.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = min(interval, threshold / 2)
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+        logger.info("Мониторинг цикла asyncio: порог %.2fс", self.threshold)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, time.monotonic() - self._beat - self.interval)
+
+    def _watch(self) -> None:
+        reported, peak = False, 0.0
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled > self.threshold:
+                peak = max(peak, stalled)
+                if not reported:
+                    reported = True
+                    self.stalls += 1
+                    frame = sys._current_frames().get(self._loop_thread)
+                    stack = "".join(traceback.format_stack(frame)) if frame is not None else "стек недоступен"
+                    logger.warning("Цикл asyncio заблокирован %.2fс, текущий шаг:\n%s", stalled, stack)
+            elif reported:
+                logger.warning("Цикл asyncio снова отвечает, блокировка длилась не меньше %.2fс", peak)
+                reported, peak = False, 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {"stalls": self.stalls, "max_lag": round(self.max_lag, 3)}
@@ -0,0 +1,43 @@
+"""Вынос блокирующей работы из цикла asyncio.
+
+run_blocking(fn, *args) выполняет fn в общем пуле: потоки по умолчанию,
+процессы при OFFLOAD_KIND=process. Для пула процессов fn и аргументы
+должны сериализоваться pickle, поэтому передаются функции уровня модуля.
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from source.core.config import settings
+
+logger = logging.getLogger("offload")
+
+T = TypeVar("T")
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        workers = max(1, settings.OFFLOAD_WORKERS)
+        if settings.OFFLOAD_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="offload")
+        logger.info("Пул для блокирующих задач: %s x%d", settings.OFFLOAD_KIND, workers)
+    return _executor
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=not wait)
+        _executor = None
@@ -0,0 +1,71 @@
+import asyncio
+import itertools
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional, Tuple
+
+PageFetcher = Callable[[int], Awaitable[Tuple[list, Optional[int]]]]
+
+
+async def paginate(
+    fetch_page: PageFetcher,
+    page_size: int,
+    window: int,
+    max_pages: int = 500,
+) -> AsyncIterator[list]:
+    """Отдаёт страницы по порядку offset, держа в полёте до window запросов.
+
+    fetch_page(offset) возвращает (items, total). Если первая страница сообщила
+    total, остальные offset известны заранее; иначе offset запрашиваются
+    спекулятивно до первой пустой страницы, а лишние запросы отменяются.
+    Короткая первая страница без total — обычно весь список; окно открывается,
+    только если одна пробная следующая страница тоже полная (лимит сервера).
+    """
+    items, total = await fetch_page(0)
+    if not items:
+        return
+    yield items
+
+    # API может молча урезать limit — тогда шагаем по фактическому размеру страницы
+    step = min(page_size, len(items))
+    if total is not None:
+        offsets: Iterable[int] = range(step, min(total, step * max_pages), step)
+    else:
+        start = step
+        if step < page_size:
+            probe, _ = await fetch_page(step)
+            if not probe:
+                return
+            yield probe
+            if len(probe) < step:
+                return
+            start += step
+        offsets = itertools.islice(itertools.count(start, step), max(0, max_pages - start // step))
+
+    async for page in _sliding_window(fetch_page, iter(offsets), window):
+        yield page
+
+
+async def _sliding_window(fetch_page: PageFetcher, offsets, window: int) -> AsyncIterator[list]:
+    pending: deque = deque()
+
+    def refill():
+        while len(pending) < max(1, window):
+            offset = next(offsets, None)
+            if offset is None:
+                return
+            pending.append(asyncio.create_task(fetch_page(offset)))
+
+    try:
+        refill()
+        while pending:
+            items, _ = await pending.popleft()
+            if not items:
+                return
+            yield items
+            refill()
+    finally:
+        # Пустая страница, ошибка или досрочный выход — запросы дальше неё не нужны
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
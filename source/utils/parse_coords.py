@@ -1,6 +1,8 @@
 import re
 from typing import Optional
 
+from source.utils.gazetteer import lookup_city
+
 def parse_city_or_coords(city_str: str) -> tuple[str, Optional[float], Optional[float]]:
     if re.match(r"^[-.\d]+[,;\s]+[-.\d]+$", city_str.strip()):
         try:
@@ -8,4 +10,14 @@ def parse_city_or_coords(city_str: str) -> tuple[str, Optional[float], Optional[
             return ("координаты", float(lat_str), float(lon_str))
         except:
             pass
-    return (city_str.strip().lower(), None, None)
\ No newline at end of file
+    city_name = city_str.strip().lower()
+    coords = lookup_city(city_name)
+    if coords is not None:
+        return (city_name, coords[0], coords[1])
+    return (city_name, None, None)
+
+
+def snap_coords(lat: float, lon: float, cell: float) -> tuple[float, float]:
+    if cell <= 0:
+        return (lat, lon)
+    return (round(round(lat / cell) * cell, 6), round(round(lon / cell) * cell, 6))
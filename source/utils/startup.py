@@ -0,0 +1,79 @@
+"""Отчёт о времени импорта при старте процесса, в духе python -X importtime.
+
+install() подменяет builtins.__import__ и замеряет каждый впервые
+импортируемый модуль: общее время (с вложенными импортами) и собственное.
+report() пишет в лог самые медленные модули и снимает подмену, чтобы
+ленивые импорты во время работы не платили за замеры.
+"""
+import builtins
+import importlib.util
+import logging
+import sys
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("startup")
+
+# Тяжёлые зависимости, о которых отчёт говорит отдельно: загружены или нет
+WATCHED_MODULES = ("pandas", "numpy", "openpyxl", "aiogram", "async_tls_client")
+
+_original_import = builtins.__import__
+_started: Optional[float] = None
+_cumulative: Dict[str, float] = {}
+_self: Dict[str, float] = {}
+_stack: List[float] = []
+
+
+def _module_name(name: str, globals, level: int) -> Optional[str]:
+    if not level:
+        return name
+    package = (globals or {}).get("__package__")
+    if not package:
+        return None
+    try:
+        return importlib.util.resolve_name("." * level + name, package)
+    except ImportError:
+        return None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    module = _module_name(name, globals, level)
+    if not module or module in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    _stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - started
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        _cumulative[module] = _cumulative.get(module, 0.0) + elapsed
+        _self[module] = _self.get(module, 0.0) + elapsed - children
+
+
+def install() -> None:
+    global _started
+    if _started is None:
+        _started = time.perf_counter()
+        builtins.__import__ = _timed_import
+
+
+def report(top: int = 15) -> None:
+    global _started
+    if _started is None:
+        return
+    builtins.__import__ = _original_import
+    total = time.perf_counter() - _started
+    _started = None
+
+    lines = [f"{'self, мс':>10} | {'всего, мс':>10} | модуль"]
+    for name in sorted(_cumulative, key=_cumulative.get, reverse=True)[:top]:
+        lines.append(f"{_self[name] * 1000:10.1f} | {_cumulative[name] * 1000:10.1f} | {name}")
+    loaded = [m for m in WATCHED_MODULES if m in sys.modules]
+    lines.append(f"загружены тяжёлые зависимости: {', '.join(loaded) or 'нет'}")
+    logger.info("Старт за %.2fс, модулей: %d\n%s", total, len(sys.modules), "\n".join(lines))
+    _cumulative.clear()
+    _self.clear()
@@ -0,0 +1,95 @@
+"""Формат записей в Redis streams.
+
+Поле ct (content-type) говорит, как читать поле data. Записи без ct —
+старый формат: ParseResult/Task как обычный JSON.
+
+v1 для ParseResult: zlib от компактного JSON, где товары лежат колонками
+(имена полей один раз, дальше строки-массивы), а не списком словарей.
+Если в результате есть и карточки, и id, строка order ("d"/"i" на товар)
+сохраняет их исходный порядок.
+"""
+import zlib
+from typing import Dict, List, Union
+
+from pydantic import TypeAdapter
+from pydantic_core import from_json, to_json
+
+from source.core.config import settings
+from source.core.dto import Task, ParseResult, ProductID, ProductDetail
+
+CT_JSON = "application/json"
+CT_RESULT_V1 = "application/vnd.foodparser.result.v1+zlib"
+
+_DETAIL_FIELDS = list(ProductDetail.model_fields)
+_ID_FIELDS = list(ProductID.model_fields)
+_META_FIELDS = [name for name in ParseResult.model_fields if name != "products"]
+
+_details = TypeAdapter(List[ProductDetail])
+_ids = TypeAdapter(List[ProductID])
+
+
+def _text(value: Union[bytes, str, None]) -> str:
+    return value.decode() if isinstance(value, bytes) else (value or "")
+
+
+def _field(fields: dict, name: str):
+    return fields.get(name.encode(), fields.get(name))
+
+
+def encode_task(task: Task) -> Dict[str, str]:
+    return {"data": task.model_dump_json(), "ct": CT_JSON}
+
+
+def decode_task(fields: dict) -> Task:
+    ct = _text(_field(fields, "ct")) or CT_JSON
+    if ct != CT_JSON:
+        raise ValueError(f"Неизвестный формат задачи: {ct}")
+    return Task.model_validate_json(_field(fields, "data"))
+
+
+def encode_result(result: ParseResult) -> Dict[str, Union[str, bytes]]:
+    if settings.WIRE_FORMAT == "json":
+        return {"data": result.model_dump_json(), "ct": CT_JSON}
+
+    details, ids, order = [], [], []
+    for p in result.products:
+        if isinstance(p, ProductDetail):
+            details.append([getattr(p, name) for name in _DETAIL_FIELDS])
+            order.append("d")
+        else:
+            ids.append([getattr(p, name) for name in _ID_FIELDS])
+            order.append("i")
+
+    payload = {
+        "meta": {name: getattr(result, name) for name in _META_FIELDS},
+        "detail": {"fields": _DETAIL_FIELDS, "rows": details},
+        "id": {"fields": _ID_FIELDS, "rows": ids},
+    }
+    if details and ids:
+        payload["order"] = "".join(order)
+    raw = to_json(payload)
+    return {"data": zlib.compress(raw, settings.WIRE_COMPRESSION_LEVEL), "ct": CT_RESULT_V1}
+
+
+def decode_result(fields: dict) -> ParseResult:
+    ct = _text(_field(fields, "ct")) or CT_JSON
+    data = _field(fields, "data")
+    if ct == CT_JSON:
+        return ParseResult.model_validate_json(data)
+    if ct != CT_RESULT_V1:
+        raise ValueError(f"Неизвестный формат результата: {ct}")
+
+    payload = from_json(zlib.decompress(data))
+    blocks = {}
+    # Имена полей берутся из записи: старые и новые воркеры читают друг друга
+    for kind, adapter in (("detail", _details), ("id", _ids)):
+        names = payload[kind]["fields"]
+        blocks[kind[0]] = adapter.validate_python([dict(zip(names, row)) for row in payload[kind]["rows"]])
+
+    order = payload.get("order")
+    if order:
+        rows = {kind: iter(items) for kind, items in blocks.items()}
+        products = [next(rows[kind]) for kind in order]
+    else:
+        products = blocks["d"] + blocks["i"]
+    return ParseResult.model_construct(**payload["meta"], products=products)
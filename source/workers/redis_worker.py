@@ -1,81 +1,279 @@
 import asyncio
+import os
+import signal
+import socket
 import time
 import logging
+
+# Без настройки корневой логгер пропускает только WARNING — отчёты и сводки уровня INFO терялись бы
+logging.basicConfig(level=logging.INFO)
+
+from source.utils import startup
+startup.install()
+
 import redis.asyncio as redis
-from aiogram import Bot
 
 from source.core.config import settings
-from source.infra.vkusvill import VkusvillParser
-from source.infra.kuper import KuperParser
+from source.infra.parsers import get_parser, loaded_parsers
+from source.infra.result_stream import RedisResultStream
+from source.infra import claim_check
+from source.utils.loop_monitor import LoopMonitor
+from source.utils.offload import shutdown as shutdown_offload
+from source.utils.wire import decode_task
 from source.core.dto import Task, ParseResult
 
 logger = logging.getLogger("redis_worker")
 logger.setLevel(logging.INFO)
 
-parsers = {"vkusvill": VkusvillParser(), "kuper": KuperParser()}
+_proxies_ready: set = set()
+
+def consumer_name() -> str:
+    return settings.CONSUMER_NAME or f"{socket.gethostname()}-{os.getpid()}"
 
-async def initialize_proxies(r: redis.Redis):
-    key = "vkusvill:proxies:free"
-    await r.delete(key)
-    proxies = settings.VKUSVILL_PROXY_LIST
-    if proxies:
-        await r.rpush(key, *proxies)
-        logger.info(f"В Redis загружено {len(proxies)} прокси для ВкусВилл")
-    else:
-        logger.warning("Список прокси пуст! Парсер будет работать с локального IP.")
+async def ready_parser(service: str, r: redis.Redis):
+    # Парсер и его прокси поднимаются при первой задаче сервиса, а не на старте воркера
+    parser = get_parser(service)
+    if service not in _proxies_ready:
+        proxies = getattr(settings, f"{service.upper()}_PROXY_LIST")
+        if not proxies:
+            logger.warning("Список прокси %s пуст! Парсер будет работать с локального IP.", service)
+        # register идемпотентен, поэтому реплики и параллельные задачи могут вызвать его одновременно
+        await parser.proxy_manager.register(r, proxies)
+        _proxies_ready.add(service)
+    return parser
 
-async def process_task(task: Task, r: redis.Redis) -> ParseResult:
+async def process_task(task: Task, r: redis.Redis, sink: RedisResultStream = None) -> ParseResult:
     logger.info("Новая задача | id=%s | %s %s | user=%s",
                 task.task_id, task.service, task.mode, task.user_id)
 
     start = time.time()
     try:
-        parser = parsers[task.service]
-        
-        if task.service == "vkusvill":
-            result = await parser.parse(task, redis_client=r)
-        else:
-            result = await parser.parse(task)
+        parser = await ready_parser(task.service, r)
+
+        result = await parser.parse(task, redis_client=r, sink=sink)
 
         result.took_seconds = round(time.time() - start, 1)
         logger.info("Задача завершена | id=%s | товаров=%d | время=%.1fс",
-                    task.task_id, len(result.products), result.took_seconds)
+                    task.task_id, len(result.products) + (sink.total if sink else 0), result.took_seconds)
         return result
     except Exception as e:
         logger.error("Ошибка обработки задачи %s: %s", task.task_id, e, exc_info=True)
         raise
 
+async def ensure_consumer_group(r: redis.Redis):
+    try:
+        await r.xgroup_create(settings.INPUT_STREAM, settings.CONSUMER_GROUP, id="$", mkstream=True)
+        logger.info("Создана группа %s для потока %s", settings.CONSUMER_GROUP, settings.INPUT_STREAM)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def handle_message(r: redis.Redis, msg_id: bytes, fields: dict):
+    raw = fields.get(b"data")
+    if not raw:
+        await r.xack(settings.INPUT_STREAM, settings.CONSUMER_GROUP, msg_id)
+        return
+
+    sink = None
+    try:
+        task = decode_task(fields)
+        if task.stream:
+            sink = RedisResultStream(r, task, settings.RESULT_CHUNK_SIZE)
+        result = await process_task(task, r, sink)
+        if sink is not None:
+            await sink.finish(result)
+        else:
+            await r.xadd(settings.OUTPUT_STREAM, await claim_check.pack(r, result))
+        await r.xack(settings.INPUT_STREAM, settings.CONSUMER_GROUP, msg_id)
+    except Exception as e:
+        logger.error("Задача %s не выполнена и остаётся в pending: %s", msg_id, e)
+        if sink is not None:
+            await sink.abort()
+
+def spawn_task(r: redis.Redis, msg_id: bytes, fields: dict, slots: asyncio.Semaphore, in_flight: dict):
+    job = asyncio.create_task(handle_message(r, msg_id, fields))
+    in_flight[msg_id] = job
+
+    def _done(_):
+        in_flight.pop(msg_id, None)
+        slots.release()
+
+    job.add_done_callback(_done)
+
+async def dead_letter(r: redis.Redis, msg_id: bytes, fields: dict, deliveries: int):
+    await r.xadd(settings.DEAD_LETTER_STREAM, {**fields, b"origin_id": msg_id, b"deliveries": str(deliveries)})
+    await r.xack(settings.INPUT_STREAM, settings.CONSUMER_GROUP, msg_id)
+    logger.error("Задача %s отправлена в %s после %d попыток", msg_id, settings.DEAD_LETTER_STREAM, deliveries)
+
+async def delivery_count(r: redis.Redis, msg_id: bytes) -> int:
+    pending = await r.xpending_range(settings.INPUT_STREAM, settings.CONSUMER_GROUP, min=msg_id, max=msg_id, count=1)
+    return pending[0]["times_delivered"] if pending else 0
+
+async def acquire_slot(slots: asyncio.Semaphore, stop: asyncio.Event) -> bool:
+    # Слот ждём наперегонки с остановкой, иначе при выключении reclaim висит до конца чужой задачи
+    acquire = asyncio.create_task(slots.acquire())
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait((acquire, stopped), return_when=asyncio.FIRST_COMPLETED)
+    stopped.cancel()
+    acquire.cancel()
+    if acquire.done() and not acquire.cancelled():
+        if not stop.is_set():
+            return True
+        slots.release()
+    return False
+
+async def prune_consumers(r: redis.Redis, consumer: str):
+    # Имя консьюмера — hostname-pid, после каждого рестарта в группе остаётся мёртвый.
+    # Удаляем только пустые: DELCONSUMER выбрасывает pending-записи консьюмера.
+    for info in await r.xinfo_consumers(settings.INPUT_STREAM, settings.CONSUMER_GROUP):
+        name = info["name"].decode() if isinstance(info["name"], bytes) else info["name"]
+        if name != consumer and not info["pending"] and info["idle"] > settings.RECLAIM_IDLE_MS:
+            await r.xgroup_delconsumer(settings.INPUT_STREAM, settings.CONSUMER_GROUP, name)
+            logger.info("Удалён неактивный консьюмер %s", name)
+
+async def remove_consumer(r: redis.Redis, consumer: str):
+    pending = await r.xpending_range(
+        settings.INPUT_STREAM, settings.CONSUMER_GROUP, min="-", max="+", count=1, consumername=consumer
+    )
+    if pending:
+        # Прерванные задачи заберёт другая реплика, пустой консьюмер она же потом удалит
+        return
+    await r.xgroup_delconsumer(settings.INPUT_STREAM, settings.CONSUMER_GROUP, consumer)
+    logger.info("Консьюмер %s удалён из группы", consumer)
+
+async def reclaim_loop(r: redis.Redis, consumer: str, slots: asyncio.Semaphore, in_flight: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.RECLAIM_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            start_id = "0-0"
+            while not stop.is_set():
+                resp = await r.xautoclaim(
+                    settings.INPUT_STREAM, settings.CONSUMER_GROUP, consumer,
+                    min_idle_time=settings.RECLAIM_IDLE_MS, start_id=start_id, count=10
+                )
+                next_id, messages = resp[0], resp[1]
+                for msg_id, fields in messages:
+                    if msg_id in in_flight:
+                        continue
+                    if not fields:
+                        await r.xack(settings.INPUT_STREAM, settings.CONSUMER_GROUP, msg_id)
+                        continue
+
+                    deliveries = await delivery_count(r, msg_id)
+                    if deliveries > settings.MAX_DELIVERIES:
+                        await dead_letter(r, msg_id, fields, deliveries)
+                        continue
+
+                    if not await acquire_slot(slots, stop):
+                        return
+                    logger.warning("Подхвачена зависшая задача %s (попытка %d)", msg_id, deliveries)
+                    spawn_task(r, msg_id, fields, slots, in_flight)
+
+                if next_id in (b"0-0", "0-0"):
+                    break
+                start_id = next_id
+            await prune_consumers(r, consumer)
+        except Exception as e:
+            logger.error("Ошибка при подхвате pending-задач: %s", e, exc_info=True)
+
+async def heartbeat_loop(r: redis.Redis, consumer: str, in_flight: dict, stop: asyncio.Event):
+    # XCLAIM JUSTID сбрасывает idle своих задач, чтобы долгий heavy не забрала другая реплика
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.HEARTBEAT_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        if not in_flight:
+            continue
+        try:
+            await r.xclaim(
+                settings.INPUT_STREAM, settings.CONSUMER_GROUP, consumer,
+                min_idle_time=0, message_ids=list(in_flight), justid=True
+            )
+        except Exception as e:
+            logger.error("Ошибка heartbeat pending-задач: %s", e)
+
 async def main():
     logger.info("Redis Worker запущен")
     r = redis.from_url(settings.REDIS_URL, decode_responses=False)
     await r.ping()
     logger.info("Подключено к Redis")
 
-    await initialize_proxies(r)
+    await ensure_consumer_group(r)
+    startup.report(settings.STARTUP_REPORT_TOP)
 
-    while True:
-        try:
-            msgs = await r.xread({settings.INPUT_STREAM: "$"}, count=1, block=5000)
-            if not msgs:
-                continue
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
 
-            for _, messages in msgs:
-                for msg_id, fields in messages:
-                    raw = fields.get(b"data")
-                    if not raw:
-                        await r.xack(settings.INPUT_STREAM, "food_group", msg_id)
-                        continue
+    monitor = None
+    if settings.LOOP_MONITOR_THRESHOLD > 0:
+        monitor = LoopMonitor(settings.LOOP_MONITOR_THRESHOLD)
+        monitor.start()
 
-                    task = Task.model_validate_json(raw.decode())
-                    
-                    result = await process_task(task, r)
+    consumer = consumer_name()
+    slots = asyncio.Semaphore(settings.WORKER_CONCURRENCY)
+    in_flight: dict[bytes, asyncio.Task] = {}
+    logger.info("Консьюмер %s | параллельных задач: %d", consumer, settings.WORKER_CONCURRENCY)
 
-                    await r.xadd(settings.OUTPUT_STREAM, {"data": result.model_dump_json()})
-                    await r.xack(settings.INPUT_STREAM, "food_group", msg_id)
+    background = [
+        asyncio.create_task(reclaim_loop(r, consumer, slots, in_flight, stop)),
+        asyncio.create_task(heartbeat_loop(r, consumer, in_flight, stop)),
+    ]
 
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=1)
+        except asyncio.TimeoutError:
+            continue
+
+        try:
+            msgs = await r.xreadgroup(
+                settings.CONSUMER_GROUP, consumer, {settings.INPUT_STREAM: ">"}, count=1, block=2000
+            )
         except Exception as e:
+            slots.release()
             logger.error("Критическая ошибка в worker: %s", e, exc_info=True)
             await asyncio.sleep(5)
+            continue
+
+        if not msgs:
+            slots.release()
+            continue
+
+        for _, messages in msgs:
+            for msg_id, fields in messages:
+                spawn_task(r, msg_id, fields, slots, in_flight)
+
+    await asyncio.gather(*background, return_exceptions=True)
+
+    if in_flight:
+        logger.info("Остановка: ждём завершения %d задач", len(in_flight))
+        _, pending = await asyncio.wait(list(in_flight.values()), timeout=settings.WORKER_SHUTDOWN_TIMEOUT)
+        for job in pending:
+            job.cancel()
+        if pending:
+            logger.warning("Прервано %d задач, они будут переданы другому консьюмеру", len(pending))
+    try:
+        await remove_consumer(r, consumer)
+    except Exception as e:
+        logger.warning("Не удалось удалить консьюмер %s: %s", consumer, e)
+    for parser in loaded_parsers().values():
+        await parser.close()
+    await r.aclose()
+    if monitor is not None:
+        monitor.stop()
+        logger.info("Задержки цикла asyncio: %s", monitor.stats())
+    shutdown_offload()
+    logger.info("Redis Worker остановлен")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
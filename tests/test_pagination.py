@@ -0,0 +1,39 @@
+import asyncio
+
+from source.utils.pagination import paginate
+
+
+def _server(total: int, cap: int = None):
+    calls = []
+
+    async def fetch(offset: int, limit: int):
+        calls.append(offset)
+        await asyncio.sleep(0)
+        size = min(limit, cap) if cap else limit
+        return list(range(offset, min(offset + size, total))), None
+
+    return fetch, calls
+
+
+async def _collect(fetch, page_size: int, window: int = 4) -> list:
+    items = []
+    async for page in paginate(lambda offset: fetch(offset, page_size), page_size, window):
+        items.extend(page)
+    return items
+
+
+def test_short_first_page_is_the_end():
+    fetch, calls = _server(total=10)
+    assert asyncio.run(_collect(fetch, page_size=60)) == list(range(10))
+    # Одна проба вместо окна спекулятивных запросов
+    assert len(calls) == 2
+
+
+def test_server_cap_is_followed():
+    fetch, calls = _server(total=75, cap=20)
+    assert asyncio.run(_collect(fetch, page_size=60)) == list(range(75))
+
+
+def test_full_pages_until_empty():
+    fetch, calls = _server(total=130)
+    assert asyncio.run(_collect(fetch, page_size=60)) == list(range(130))
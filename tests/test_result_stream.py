@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+os.environ.setdefault("TG_BOT_TOKEN", "123:abc")
+
+from source.core.dto import ParseResult, ProductDetail, Task
+from source.infra.result_stream import RedisResultStream
+from source.utils.wire import decode_result
+
+
+class _StreamStub:
+    def __init__(self):
+        self.entries = []
+
+    async def xadd(self, stream, fields):
+        await asyncio.sleep(0)
+        self.entries.append(fields)
+
+
+def _products(prefix: str, count: int):
+    return [
+        ProductDetail(product_id=f"{prefix}-{i}", name="x", price=1.0, category="c")
+        for i in range(count)
+    ]
+
+
+def test_concurrent_add_publishes_contiguous_seq():
+    task = Task(task_id="t1", service="kuper", mode="heavy", user_id=1, chat_id=1, stream=True)
+    r = _StreamStub()
+
+    async def run():
+        sink = RedisResultStream(r, task, chunk_size=5)
+        await asyncio.gather(*(sink.add(_products(str(n), 13)) for n in range(8)))
+        await sink.finish(ParseResult(
+            task_id="t1", service="kuper", mode="heavy", products=[], took_seconds=0, user_id=1, chat_id=1
+        ))
+        return sink
+
+    sink = asyncio.run(run())
+
+    seqs = [int(e["seq"]) for e in r.entries]
+    assert seqs == list(range(1, len(r.entries) + 1))
+    assert [e["kind"] for e in r.entries][-1] == "final"
+
+    rows = [p.product_id for e in r.entries if e["kind"] == "chunk" for p in decode_result(e).products]
+    assert len(rows) == len(set(rows)) == 8 * 13
+    assert sink.count == 8 * 13
+    assert r.entries[-1]["total"] == str(8 * 13)
@@ -0,0 +1,44 @@
+import os
+import zlib
+
+os.environ.setdefault("TG_BOT_TOKEN", "123:abc")
+
+from pydantic_core import from_json, to_json
+
+from source.core.dto import ParseResult, ProductDetail, ProductID
+from source.utils.wire import CT_RESULT_V1, decode_result, encode_result
+
+
+def _result(products):
+    return ParseResult(
+        task_id="t1", service="kuper", mode="fast", products=products,
+        took_seconds=1.0, user_id=1, chat_id=1,
+    )
+
+
+def test_mixed_products_keep_order():
+    products = [
+        ProductID(product_id="1", category="c"),
+        ProductDetail(product_id="2", name="x", price=1.0, category="c"),
+        ProductID(product_id="3", category="c"),
+    ]
+    fields = encode_result(_result(products))
+    assert fields["ct"] == CT_RESULT_V1
+
+    decoded = decode_result(fields)
+    assert [p.product_id for p in decoded.products] == ["1", "2", "3"]
+    assert [type(p) for p in decoded.products] == [ProductID, ProductDetail, ProductID]
+
+
+def test_record_without_order_is_read():
+    # Записи старых воркеров: поля order нет, сначала карточки, потом id
+    fields = encode_result(_result([
+        ProductID(product_id="1", category="c"),
+        ProductDetail(product_id="2", name="x", price=1.0, category="c"),
+    ]))
+    payload = from_json(zlib.decompress(fields["data"]))
+    del payload["order"]
+    fields["data"] = zlib.compress(to_json(payload))
+
+    decoded = decode_result(fields)
+    assert [p.product_id for p in decoded.products] == ["2", "1"]
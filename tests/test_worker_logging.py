@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_worker_shows_parser_info_logs():
+    # Сводки парсеров (карт/с, кэш, пул) пишутся на INFO и должны доходить до вывода воркера
+    code = (
+        "import logging\n"
+        "import source.workers.redis_worker\n"
+        "logging.getLogger('vkusvill_parser').info('Vkusvill heavy карточки | 1/1')\n"
+    )
+    env = {**os.environ, "TG_BOT_TOKEN": "123:abc", "PYTHONPATH": ROOT}
+    proc = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    assert "Vkusvill heavy карточки | 1/1" in proc.stderr